@@ -0,0 +1,40 @@
+def project_lines(n):
+  # every kind of timeline line in turn: clips with fades, speed-ups and crops, images, color cards and snapshots
+  lines = []
+  sound_open, overlay_open = False, None
+  for i in range(n):
+    if i % 8 == 1 and not sound_open:
+      lines.append(f"music.wav ast 00:{i % 50:02d} sf 1 v 0.5")
+      sound_open = True
+    elif i % 8 == 6 and sound_open:
+      lines.append("music.wav aend")
+      sound_open = False
+    if i % 10 == 3 and overlay_open is None:
+      overlay_open = "logo.png"
+      lines.append("logo.png ovlim ovlx 70 ovly 5 ovlw 25 ovlh 25")
+    elif i % 10 == 8 and overlay_open:
+      lines.append(f"{overlay_open} ovlend")
+      overlay_open = None
+    clip = f"clip{i % 3}.mp4"
+    kind = i % 6
+    if kind == 0:
+      lines.append(f"{clip} ts 00:02 te 00:08 f 0.5 text 0" + (" base 1" if i == 0 else ""))
+    elif kind == 1:
+      lines.append(f"{clip} ts 00:05 te 00:25 r 4 f 0.5")
+    elif kind == 2:
+      lines.append(f"card.png dt 3 f 0.5 text 1")
+    elif kind == 3:
+      lines.append(f"{clip} ts 00:10 te 00:16 cropw 50 croph 50 cropx 25 cropy 25")
+    elif kind == 4:
+      lines.append(f"color black dt 2 f 0.5")
+    else:
+      lines.append(f"{clip} ss 00:{(i % 25) + 1:02d} dt 2 text 0")
+  if sound_open:
+    lines.append("music.wav aend")
+  if overlay_open:
+    lines.append(f"{overlay_open} ovlend")
+  return lines
+
+def project_texts():
+  return ["'Benchmark' size 48 x 50 y 80 f 0.5 scolor black shx 2 shy 2",
+          "'Title card' size0 32 size1 64 x0 20 y0 20 x1 80 y1 80"]
@@ -0,0 +1,141 @@
+#!/usr/bin/python
+
+import os, sys, argparse, subprocess, json, math, tracemalloc
+from datetime import datetime
+from contextlib import redirect_stdout
+from bench_project import project_lines, project_texts
+
+repoFolder = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+parser = argparse.ArgumentParser("Planner benchmark with stubbed ffprobe")
+parser.add_argument('-n', help='Comma separated numbers of timeline lines', default="100,1000,10000,100000", type=str, dest='sizes')
+parser.add_argument('-fs', help='Fragment size', default=10, type=int, dest='fragmentSize')
+parser.add_argument('-d', help='Benchmark folder', default="/tmp/videomaker_planner_bench", type=str, dest='benchFolder')
+parser.add_argument('-nm', help='Do not trace memory (faster, times only)', action="store_true", dest='noMemory')
+parser.add_argument('-e', help='Largest allowed scaling exponent of a phase between two sizes', default=1.3, type=float, dest='maxExponent')
+parser.add_argument('-mt', help='Phases faster than this many seconds are not checked for scaling', default=0.05, type=float, dest='minTime')
+parser.add_argument('-o', help='Results file', default="", type=str, dest='resultsFile')
+parser.add_argument('-worker', help=argparse.SUPPRESS, default=0, type=int, dest='worker')
+
+args = parser.parse_args(sys.argv[1:])
+
+video_streams = [{"codec_type": "video", "codec_name": "h264", "width": 1280, "height": 720, "r_frame_rate": "30/1", "duration": "30.0"},
+                 {"codec_type": "audio", "sample_rate": "48000", "duration": "30.0"}]
+image_streams = [{"codec_type": "video", "codec_name": "png", "width": 1280, "height": 720}]
+sound_streams = [{"codec_type": "audio", "sample_rate": "48000", "duration": "600.0"}]
+
+def fake_probe_media(fname):
+  ext = os.path.splitext(fname)[1]
+  if ext in [".png", ".jpg"]:
+    return image_streams
+  if ext in [".wav", ".mp3"]:
+    return sound_streams
+  return video_streams
+
+def make_project(projectFolder, projectName, n):
+  # empty media files are enough, ffprobe is replaced by fake_probe_media
+  for folder, files in [("src", ["clip0.mp4", "clip1.mp4", "clip2.mp4"]), ("images", ["card.png", "logo.png"]), ("sounds", ["music.wav"]), ("snapshots", []), ("work", []), ("temp", []), ("output", [])]:
+    os.makedirs(os.path.join(projectFolder, folder), exist_ok=True)
+    for fname in files:
+      open(os.path.join(projectFolder, folder, fname), "wb").close()
+  with open(os.path.join(projectFolder, projectName + ".cfg"), "wt") as f:
+    f.write('\n'.join(project_lines(n)) + '\n')
+  with open(os.path.join(projectFolder, projectName + ".txt"), "wt") as f:
+    f.write('\n'.join(project_texts()) + '\n')
+  probeCache = os.path.join(projectFolder, "probe_cache.json")
+  if os.path.exists(probeCache):
+    os.remove(probeCache)
+
+def measure(phases, name, fn):
+  if not args.noMemory:
+    tracemalloc.reset_peak()
+    mem0 = tracemalloc.get_traced_memory()[0]
+  ts = datetime.now()
+  with open(os.devnull, "wt") as devnull, redirect_stdout(devnull):
+    r = fn()
+  phase = {"time": round((datetime.now() - ts).total_seconds(), 4)}
+  if not args.noMemory:
+    phase["peak_mb"] = round((tracemalloc.get_traced_memory()[1] - mem0) / (1024 * 1024), 2)
+  phases[name] = phase
+  return r
+
+def run_worker(n):
+  projectName = f"planner_{n}"
+  projectFolder = os.path.join(args.benchFolder, projectName)
+  make_project(projectFolder, projectName, n)
+  sys.argv = ["makevideo.py", "-pf", args.benchFolder, "-pn", projectName, "-fs", f"{args.fragmentSize}"]
+  sys.path.insert(0, repoFolder)
+  if not args.noMemory:
+    tracemalloc.start()
+  phases = {}
+  mv = measure(phases, "import", lambda: __import__("makevideo"))
+  mv.probe_media = fake_probe_media
+  ffcmds_list, ffsnds_list, ffovls_list = measure(phases, "generate", mv.generate_ffcmds_list)
+  measure(phases, "verify", lambda: [ffcmd.verify() for ffcmd in ffcmds_list] + [ffovl.verify() for ffovl in ffovls_list])
+  strfileName = os.path.join(projectFolder, "output", projectName + mv.srtExt)
+  measure(phases, "subtitles", lambda: mv.create_subtitles_file(ffcmds_list, strfileName))
+  fragments = measure(phases, "split", lambda: mv.split_fragments(ffcmds_list[:], ffovls_list))
+  framerate, asample_rate = ffcmds_list[0].framerate, ffcmds_list[0].asample_rate
+  ofile = os.path.join(projectFolder, "temp", "temp" + mv.intermediateExt)
+  parts = measure(phases, "filters", lambda: [mv.merge_part(frag[0], frag[1], framerate, asample_rate, ofile) for frag in fragments])
+  measure(phases, "plan", lambda: [mv.plan_stage(f"fragment_{i}", ffmpeg_cmds, part_dt) for i, (part_dt, ffmpeg_cmds) in enumerate(parts)])
+  # the whole sound planning: cue lanes, shared inputs and filters, without running ffmpeg
+  mv.debug_no_ffmpeg_exec = True
+  sound_duration = sum([ffcmd.part_deltat() for ffcmd in ffcmds_list if ffcmd.create_out])
+  osfile = os.path.join(projectFolder, "temp", "sound_temp" + mv.intermediateExt)
+  measure(phases, "sound", lambda: mv.make_sound(ffsnds_list, osfile, sound_duration) if len(ffsnds_list) > 0 else None)
+  result = {"lines": n, "commands": len(ffcmds_list), "fragments": len(fragments), "overlays": len(ffovls_list), "sounds": len(ffsnds_list), "phases": phases}
+  print(json.dumps(result))
+
+def run_size(n):
+  cmds = [sys.executable, os.path.realpath(__file__), "-worker", f"{n}", "-fs", f"{args.fragmentSize}", "-d", args.benchFolder]
+  if args.noMemory:
+    cmds.append("-nm")
+  p = subprocess.run(cmds, stdout=subprocess.PIPE, encoding='utf-8')
+  if p.returncode != 0:
+    raise RuntimeError(f"planner benchmark for {n} lines failed")
+  return json.loads(p.stdout.strip().split('\n')[-1])
+
+def print_result(result):
+  print(f"{result['lines']} lines, {result['commands']} commands, {result['fragments']} fragments, {result['overlays']} overlays, {result['sounds']} sounds")
+  for name, phase in result["phases"].items():
+    mem = f"  peak {phase['peak_mb']:8.2f} MB" if "peak_mb" in phase else ""
+    print(f"  {name:<10} {phase['time']:9.4f} s{mem}")
+
+def check_scaling(results):
+  # time(n) ~ n^e, e close to 1 means linear planning
+  failed = []
+  for r0, r1 in zip(results[:-1], results[1:]):
+    for name, phase in r1["phases"].items():
+      if name == "import":
+        continue
+      t0, t1 = r0["phases"][name]["time"], phase["time"]
+      if t1 < args.minTime or t0 <= 0:
+        continue
+      exponent = math.log(t1 / t0) / math.log(r1["lines"] / r0["lines"])
+      mark = ""
+      if exponent > args.maxExponent:
+        mark = "  SUPERLINEAR"
+        failed.append(f"{name} {r0['lines']}->{r1['lines']}")
+      print(f"  {name:<10} {r0['lines']:>7} -> {r1['lines']:<7} exponent {exponent:5.2f}{mark}")
+  return failed
+
+if __name__ == "__main__":
+  if args.worker > 0:
+    run_worker(args.worker)
+    sys.exit(0)
+  sizes = [int(n) for n in args.sizes.split(',')]
+  results = []
+  for n in sizes:
+    result = run_size(n)
+    print_result(result)
+    results.append(result)
+  print("scaling:")
+  failed = check_scaling(results)
+  resultsFile = args.resultsFile or os.path.join(args.benchFolder, "planner_results.json")
+  with open(resultsFile, "wt") as f:
+    json.dump({"time": datetime.now().isoformat(timespec='seconds'), "fragment_size": args.fragmentSize, "results": results}, f, indent=1)
+  print(f"results are written to {resultsFile}")
+  if len(failed) > 0:
+    print(f"superlinear phases: {', '.join(failed)}")
+    sys.exit(1)
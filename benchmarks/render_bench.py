@@ -0,0 +1,134 @@
+#!/usr/bin/python
+
+import os, sys, argparse, subprocess, shutil, json
+from datetime import datetime
+from bench_project import project_lines, project_texts
+
+makevideo = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "makevideo.py")
+
+parser = argparse.ArgumentParser("End-to-end render benchmark on synthetic lavfi projects")
+parser.add_argument('-n', help='Number of timeline lines in the project', default=20, type=int, dest='lines')
+parser.add_argument('-fs', help='Fragment size passed to makevideo', default=10, type=int, dest='fragmentSize')
+parser.add_argument('-W', help='Video width', default=1280, type=int, dest='width')
+parser.add_argument('-H', help='Video height', default=720, type=int, dest='height')
+parser.add_argument('-fr', help='Video frame rate', default=30, type=int, dest='frameRate')
+parser.add_argument('-j', help='Render jobs passed to makevideo', default=1, type=int, dest='jobs')
+parser.add_argument('-d', help='Benchmark folder', default="/tmp/videomaker_bench", type=str, dest='benchFolder')
+parser.add_argument('-ff', help='ffmpeg executable used to generate the sources', default="ffmpeg", type=str, dest='ffmpeg')
+parser.add_argument('-b', help='Baseline file to compare with', default="", type=str, dest='baseline')
+parser.add_argument('-sb', help='Save results as the new baseline', action="store_true", dest='saveBaseline')
+parser.add_argument('-t', help='Allowed slowdown against baseline, 0.1 = 10%%', default=0.1, type=float, dest='tolerance')
+parser.add_argument('-o', help='Results file', default="", type=str, dest='resultsFile')
+parser.add_argument('-keep', help='Keep generated sources between runs', action="store_true", dest='keep')
+
+args = parser.parse_args(sys.argv[1:])
+
+projectName = f"bench_{args.lines}_{args.width}x{args.height}"
+projectFolder = os.path.join(args.benchFolder, projectName)
+clipDuration = 30
+soundDuration = 600
+
+def lavfi(ofile, cmds):
+  if os.path.exists(ofile):
+    return
+  ffmpeg_cmds = [args.ffmpeg, "-y", "-nostdin", "-loglevel", "error"] + cmds + [ofile]
+  subprocess.run(ffmpeg_cmds, check=True)
+
+def make_sources():
+  for folder in ["src", "images", "snapshots", "sounds", "work", "temp", "output"]:
+    os.makedirs(os.path.join(projectFolder, folder), exist_ok=True)
+  size = f"{args.width}x{args.height}"
+  for i in range(3):
+    lavfi(os.path.join(projectFolder, "src", f"clip{i}.mp4"), ["-f", "lavfi", "-i", f"testsrc2=s={size}:r={args.frameRate}:d={clipDuration}",
+      "-f", "lavfi", "-i", f"sine=f={440*(i+1)}:d={clipDuration}", "-c:v", "libx264", "-preset", "veryfast", "-g", f"{args.frameRate}", "-c:a", "aac", "-shortest"])
+  lavfi(os.path.join(projectFolder, "images", "card.png"), ["-f", "lavfi", "-i", f"testsrc2=s={size}", "-frames:v", "1"])
+  lavfi(os.path.join(projectFolder, "images", "logo.png"), ["-f", "lavfi", "-i", "testsrc2=s=320x180", "-frames:v", "1"])
+  lavfi(os.path.join(projectFolder, "sounds", "music.wav"), ["-f", "lavfi", "-i", f"sine=f=220:d={soundDuration}", "-ac", "2"])
+
+def make_project():
+  if os.path.exists(projectFolder) and not args.keep:
+    for folder in ["work", "temp", "output", "cache", "snapshots"]:
+      shutil.rmtree(os.path.join(projectFolder, folder), ignore_errors=True)
+  make_sources()
+  with open(os.path.join(projectFolder, projectName + ".cfg"), "wt") as f:
+    f.write('\n'.join(project_lines(args.lines)) + '\n')
+  with open(os.path.join(projectFolder, projectName + ".txt"), "wt") as f:
+    f.write('\n'.join(project_texts()) + '\n')
+
+progressFile = os.path.join(projectFolder, "output", projectName + "_progress.jsonl")
+
+def run_stage(name, options, ofile=None):
+  # wait4 reports the rusage of the makevideo process together with all ffmpeg processes it waited for;
+  # a run counts only if it exits with 0, writes its output and finishes the build in the progress file
+  cmds = [sys.executable, makevideo, "-pf", args.benchFolder, "-pn", projectName, "-fs", f"{args.fragmentSize}", "-j", f"{args.jobs}"] + options
+  for fname in [progressFile, ofile]:
+    if fname and os.path.exists(fname):
+      os.remove(fname)
+  ts = datetime.now()
+  p = subprocess.Popen(cmds, stdout=subprocess.DEVNULL)
+  _, status, usage = os.wait4(p.pid, 0)
+  wall = (datetime.now() - ts).total_seconds()
+  if status != 0 or (ofile and not os.path.exists(ofile)) or not "build" in read_progress_stages():
+    raise RuntimeError(f"{name} failed: {' '.join(cmds)}")
+  result = {"wall": round(wall, 3), "cpu": round(usage.ru_utime + usage.ru_stime, 3), "max_rss_mb": round(usage.ru_maxrss / 1024, 1)}
+  print(f"{name:<8} wall {result['wall']:8.2f} s  cpu {result['cpu']:8.2f} s  peak rss {result['max_rss_mb']:8.1f} MB")
+  return result
+
+def read_progress_stages():
+  # ffmpeg stages have their own CPU time and peak RSS from run_ffmpeg, the build entry has the wall time only
+  stages = {}
+  if not os.path.exists(progressFile):
+    return stages
+  with open(progressFile, "rt") as f:
+    for line in f:
+      entry = json.loads(line)
+      if entry["event"] == "end":
+        stages[entry["stage"]] = {key: entry[key] for key in ["wall", "cpu", "max_rss_mb"] if key in entry}
+  return stages
+
+def compare(results, baseline):
+  regressions = []
+  for stage, values in results["stages"].items():
+    base = baseline.get("stages", {}).get(stage)
+    if not base:
+      continue
+    for key in ["wall", "cpu", "max_rss_mb"]:
+      if base[key] <= 0:
+        continue
+      ratio = values[key] / base[key]
+      mark = ""
+      if ratio > 1.0 + args.tolerance:
+        mark = "  REGRESSION"
+        regressions.append(f"{stage} {key}")
+      print(f"{stage:<8} {key:<10} {base[key]:10.2f} -> {values[key]:10.2f}  {ratio:6.2f}x{mark}")
+  return regressions
+
+if __name__ == "__main__":
+  make_project()
+  params = {"lines": args.lines, "fragment_size": args.fragmentSize, "width": args.width, "height": args.height, "frame_rate": args.frameRate, "jobs": args.jobs}
+  results = {"params": params, "time": datetime.now().isoformat(timespec='seconds'), "stages": {}}
+  results["stages"]["cut"] = run_stage("cut", ["-c"])
+  results["cut_stages"] = read_progress_stages()
+  results["stages"]["merge"] = run_stage("merge", ["-mg", "-nc"], os.path.join(projectFolder, "output", projectName + ".mp4"))
+  results["merge_stages"] = read_progress_stages()
+  results["stages"]["build"] = {"wall": round(sum([st["wall"] for st in results["stages"].values()]), 3),
+    "cpu": round(sum([st["cpu"] for st in results["stages"].values()]), 3),
+    "max_rss_mb": max([st["max_rss_mb"] for st in results["stages"].values()])}
+  resultsFile = args.resultsFile or os.path.join(args.benchFolder, projectName + "_results.json")
+  with open(resultsFile, "wt") as f:
+    json.dump(results, f, indent=1)
+  print(f"results are written to {resultsFile}")
+  regressions = []
+  if args.baseline and os.path.exists(args.baseline) and not args.saveBaseline:
+    with open(args.baseline, "rt") as f:
+      baseline = json.load(f)
+    if baseline.get("params") != params:
+      print(f"warning: baseline parameters {baseline.get('params')} differ from {params}")
+    regressions = compare(results, baseline)
+  if args.saveBaseline and args.baseline:
+    with open(args.baseline, "wt") as f:
+      json.dump(results, f, indent=1)
+    print(f"baseline is saved to {args.baseline}")
+  if len(regressions) > 0:
+    print(f"regressions: {', '.join(regressions)}")
+    sys.exit(1)
@@ -1,12 +1,14 @@
 #!/usr/bin/python
 
-import os, string, os.path, sys, re, argparse, subprocess, shutil, math
+import os, string, os.path, sys, re, argparse, subprocess, shutil, math, json, hashlib, threading, heapq, tempfile
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from copy import deepcopy
+from copy import copy
 
 defaultProjectsFolder = ""
 partPrefix = 'p'
 videoExt = '.mp4'
+intermediateExt = '.mov'
 srtExt = '.srt'
 videoWidth = 1920
 videoHeight = 1080
@@ -19,8 +21,37 @@ colorKey = "white"
 fragment_size = 10
 videoTimebase = 90000
 snapshotsExt = ['.jpg', '.png', '.jpeg']
-
-debug_no_ffmpeg_exec = False
+colorSourceRate = 25
+verifyDuration = False
+fragmentSplit = "cost"
+cutMode = "copy"
+smartCutPreset = "medium"
+smartCutCrf = 16
+inputCost = 50.0
+deliveryEncode = False
+deliveryVcodec = "libx264"
+deliveryPreset = "medium"
+deliveryCrf = 18
+deliveryKeyint = 0.5
+deliveryBframes = 2
+deliveryPixFmt = "yuv420p"
+deliveryAcodec = "aac"
+deliveryAbitrate = "192k"
+deliveryAsampleRate = 48000
+renditions = ""
+streamFormat = ""
+segmentTime = 6
+previewScale = 0.25
+previewFrameRate = 15
+intermediateVcodec = ""
+intermediatePreset = "ultrafast"
+intermediateCrf = 12
+defaultTemporaryFolder = "temp"
+renderJobs = 1
+cutJobs = 4
+probeCacheHash = False
+probeJobs = 8
+fragmentCacheSize = 0
 
 with open(os.path.splitext(os.path.realpath(__file__))[0] + ".cfg", "rt") as f:
   for line in f.readlines():
@@ -55,6 +86,66 @@ with open(os.path.splitext(os.path.realpath(__file__))[0] + ".cfg", "rt") as f:
         fragment_size = int(value)
       if key == "VIDEO_TIMEBASE":
         videoTimebase = int(value)
+      if key == "JOBS":
+        renderJobs = int(value)
+      if key == "CUT_JOBS":
+        cutJobs = int(value)
+      if key == "PROBE_CACHE_HASH":
+        probeCacheHash = int(value) != 0
+      if key == "PROBE_JOBS":
+        probeJobs = int(value)
+      if key == "FRAGMENT_CACHE_SIZE":
+        fragmentCacheSize = int(value)
+      if key == "VERIFY_DURATION":
+        verifyDuration = int(value) != 0
+      if key == "FRAGMENT_SPLIT":
+        fragmentSplit = value
+      if key == "CUT_MODE":
+        cutMode = value
+      if key == "SMART_CUT_PRESET":
+        smartCutPreset = value
+      if key == "SMART_CUT_CRF":
+        smartCutCrf = int(value)
+      if key == "DELIVERY_ENCODE":
+        deliveryEncode = int(value) != 0
+      if key == "DELIVERY_VCODEC":
+        deliveryVcodec = value
+      if key == "DELIVERY_PRESET":
+        deliveryPreset = value
+      if key == "DELIVERY_CRF":
+        deliveryCrf = int(value)
+      if key == "DELIVERY_KEYINT":
+        deliveryKeyint = float(value)
+      if key == "DELIVERY_BFRAMES":
+        deliveryBframes = int(value)
+      if key == "DELIVERY_PIX_FMT":
+        deliveryPixFmt = value
+      if key == "DELIVERY_ACODEC":
+        deliveryAcodec = value
+      if key == "DELIVERY_ABITRATE":
+        deliveryAbitrate = value
+      if key == "DELIVERY_AUDIO_SAMPLE_RATE":
+        deliveryAsampleRate = int(value)
+      if key == "RENDITIONS":
+        renditions = "" if value == "none" else value
+      if key == "STREAM_FORMAT":
+        streamFormat = "" if value == "none" else value
+      if key == "SEGMENT_TIME":
+        segmentTime = float(value)
+      if key == "PREVIEW_SCALE":
+        previewScale = float(value)
+      if key == "PREVIEW_FRAME_RATE":
+        previewFrameRate = int(value)
+      if key == "INTERMEDIATE_VCODEC":
+        intermediateVcodec = "" if value == "default" else value
+      if key == "INTERMEDIATE_PRESET":
+        intermediatePreset = value
+      if key == "INTERMEDIATE_CRF":
+        intermediateCrf = int(value)
+      if key == "INTERMEDIATE_EXT":
+        intermediateExt = value
+      if key == "TEMP_FOLDER":
+        defaultTemporaryFolder = value
 
 parser = argparse.ArgumentParser("Simple video maker based on ffmpeg")
 parser.add_argument('-s', help='Source moves folder', default="src", type=str, dest='sourceFolder')
@@ -62,7 +153,8 @@ parser.add_argument('-im', help='Images folder', default="images", type=str, des
 parser.add_argument('-ss', help='Snapshots folder', default="snapshots", type=str, dest='snapshotsFolder')
 parser.add_argument('-sn', help='Sounds folder', default="sounds", type=str, dest='soundsFolder')
 parser.add_argument('-w', help='Working folder', default="work", type=str, dest='workingFolder')
-parser.add_argument('-tmp', help='Temporary folder', default="temp", type=str, dest='temporaryFolder')
+parser.add_argument('-tmp', help='Temporary folder, absolute path (e.g. tmpfs) gets project name subfolder', default=defaultTemporaryFolder, type=str, dest='temporaryFolder')
+parser.add_argument('-fc', help='Rendered fragments cache folder', default="cache", type=str, dest='fragmentCacheFolder')
 parser.add_argument('-pf', help='Projects folder', default=defaultProjectsFolder, type=str, dest='projectsFolder')
 parser.add_argument('-pn', help='Project name', default='proj1', type=str, dest='projectName')
 parser.add_argument('-o', help='Output moves folder', default="output", type=str, dest='outputFolder')
@@ -77,9 +169,23 @@ parser.add_argument('-tl', help='Print time lines', action="store_true", dest='t
 parser.add_argument('-so', help='Rebuild sound only', action="store_true", dest='soundOnly')
 parser.add_argument('-rm', help='Remove old output file if exists', action="store_true", dest='removeOld')
 parser.add_argument('-wb', help='Convert webm to mp4', action="store_true", dest='webm')
+parser.add_argument('-yt', help='Encode input file with delivery settings', action="store_true", dest='youtube')
+parser.add_argument('-j', help='Number of video fragments rendered in parallel', default=renderJobs, type=int, dest='jobs')
+parser.add_argument('-fs', help='Number of commands (timeline parts) per video fragment', default=fragment_size, type=int, dest='fragmentSize')
+parser.add_argument('-cj', help='Number of concurrent cut and snapshot jobs', default=cutJobs, type=int, dest='cutJobs')
+parser.add_argument('-cm', help='Cut mode: copy cuts at keyframes, smart re-encodes only the partial GOPs at both ends, direct renders from the sources without cuts; clip names depend on the mode, so -mg needs the same mode as -c', default=cutMode, type=str, choices=['copy', 'smart', 'direct'], dest='cutMode')
+parser.add_argument('-vd', help='Verify calculated durations of color and image fragments by test encoding', action="store_true", default=verifyDuration, dest='verifyDuration')
+parser.add_argument('-plan', '--plan', help='Write render plan as JSON to given file (default output/<project_name>_plan.json) without running ffmpeg', nargs='?', const='', default=None, type=str, dest='planFile')
+parser.add_argument('-nc', help='Re-render all video fragments ignoring the fragments cache', action="store_true", dest='noCache')
+parser.add_argument('-rd', help='Output renditions as comma separated WIDTHxHEIGHT:BITRATE list, e.g. 1280x720:3M,854x480:1200k', default=renditions, type=str, dest='renditions')
+parser.add_argument('-sf', help='Package renditions as hls or dash', default=streamFormat, type=str, choices=['', 'hls', 'dash'], dest='streamFormat')
+parser.add_argument('-from', '--from', help='Render only the part of the timeline starting at given time (MM:SS, MM:SS.f or seconds)', default=None, type=str, dest='rangeFrom')
+parser.add_argument('-to', '--to', help='Render only the part of the timeline ending at given time (MM:SS, MM:SS.f or seconds)', default=None, type=str, dest='rangeTo')
+parser.add_argument('-pv', '--preview', help='Render a low resolution preview (PREVIEW_SCALE, PREVIEW_FRAME_RATE) with the fastest encoder preset', action="store_true", dest='preview')
 
 
 args = parser.parse_args(sys.argv[1:])
+fragment_size = args.fragmentSize
 
 projectFolder = os.path.join(args.projectsFolder, args.projectName)
 imagesFolder = os.path.join(projectFolder, args.imagesFolder)
@@ -88,14 +194,43 @@ soundsFolder = os.path.join(projectFolder, args.soundsFolder)
 sourceFolder = os.path.join(projectFolder, args.sourceFolder)
 workingFolder = os.path.join(projectFolder, args.workingFolder)
 temporaryFolder = os.path.join(projectFolder, args.temporaryFolder)
+if os.path.isabs(args.temporaryFolder):
+  temporaryFolder = os.path.join(args.temporaryFolder, args.projectName)
+fragmentCacheFolder = os.path.join(projectFolder, args.fragmentCacheFolder)
 outputFolder = os.path.join(projectFolder, args.outputFolder)
 configFileName = os.path.join(projectFolder, args.projectName+'.cfg')
 textsFileName = os.path.join(projectFolder, args.projectName+'.txt')
+probeCacheFileName = os.path.join(projectFolder, "probe_cache.json")
+cutManifestFileName = os.path.join(workingFolder, "manifest.json")
 outputFileName = args.outputFile
 
 if len(outputFileName) == 0:
   outputFileName = args.projectName + videoExt
 
+renderScale = 1.0
+if args.preview:
+  # same timeline at a fraction of the size, kept apart from the full renders
+  renderScale = previewScale
+  frameRate = min(frameRate, previewFrameRate)
+  intermediateVcodec = "libx264"
+  intermediatePreset = "ultrafast"
+  deliveryPreset = "ultrafast"
+  args.renditions = ""
+  args.streamFormat = ""
+  temporaryFolder = os.path.join(temporaryFolder, "preview")
+  fragmentCacheFolder = os.path.join(fragmentCacheFolder, "preview")
+  outputFileName = os.path.splitext(outputFileName)[0] + "_preview" + videoExt
+
+if args.rangeFrom or args.rangeTo:
+  rangeSuffix = f"_{args.rangeFrom or 'start'}_{args.rangeTo or 'end'}".replace(':', '-')
+  outputFileName = os.path.splitext(outputFileName)[0] + rangeSuffix + videoExt
+
+debug_no_ffmpeg_exec = args.planFile is not None
+planFileName = args.planFile
+progressFileName = os.path.join(outputFolder, args.projectName + "_progress.jsonl")
+if planFileName is not None and len(planFileName) == 0:
+  planFileName = os.path.join(outputFolder, args.projectName + "_plan.json")
+
 def make_project():
   if not os.path.exists(projectFolder):
     os.makedirs(projectFolder)
@@ -153,9 +288,326 @@ def time2srttime(t):
   srt = "%02d:%02d:%02d,%03d" % (h, m, s, ms)
   return srt
 
+def ffmpeg_threads(jobs):
+  if jobs <= 1:
+    return 0
+  return max(1, (os.cpu_count() or 1) // jobs)
+
+render_plan = []
+plan_outputs = {}
+
+def plan_stage(name, ffmpeg_cmds, duration=0.0, deps=None, outputs=None, cached=False):
+  inputs = [ffmpeg_cmds[i+1] for i in range(len(ffmpeg_cmds)-1) if ffmpeg_cmds[i] == '-i']
+  filtergraph = ""
+  if '-filter_complex' in ffmpeg_cmds:
+    filtergraph = ffmpeg_cmds[ffmpeg_cmds.index('-filter_complex')+1]
+  if outputs is None:
+    outputs = ffmpeg_cmds[-1:]
+  deps = list(deps or [])
+  for ifile in inputs:
+    if ifile in plan_outputs and not plan_outputs[ifile] in deps:
+      deps.append(plan_outputs[ifile])
+  stage = {"name": name, "inputs": inputs, "filtergraph": filtergraph, "outputs": outputs, "duration": duration, "dependencies": deps, "cached": cached, "command": ffmpeg_cmds}
+  render_plan.append(stage)
+  for ofile in outputs:
+    plan_outputs[ofile] = name
+  return stage
+
+def write_plan(fname, planning_time):
+  if os.path.dirname(fname):
+    os.makedirs(os.path.dirname(fname), exist_ok=True)
+  with open(fname, "wt") as f:
+    json.dump({"project": args.projectName, "planning_time": planning_time, "stages": render_plan}, f, indent=1)
+  print(f"render plan with {len(render_plan)} stages is written to {fname}")
+
+build_progress = {"start": datetime.now(), "total": 0.0, "done": {}, "printed": None, "stages": [], "file": None, "opened": False}
+progress_lock = threading.Lock()
+
+def open_progress():
+  # only runs that execute ffmpeg write the progress file, a cut and a merge in one run share it
+  if debug_no_ffmpeg_exec:
+    return
+  with progress_lock:
+    if build_progress["file"] is None:
+      os.makedirs(outputFolder, exist_ok=True)
+      build_progress["file"] = open(progressFileName, "at" if build_progress["opened"] else "wt")
+      build_progress["opened"] = True
+
+def close_progress():
+  total = (datetime.now() - build_progress["start"]).total_seconds()
+  report_progress("build", "end", wall=round(total, 3), duration=sum([entry["duration"] for entry in build_progress["stages"]]))
+  with progress_lock:
+    if build_progress["file"] is not None:
+      build_progress["file"].close()
+      build_progress["file"] = None
+
+def report_progress(name, event, **values):
+  entry = dict({"time": datetime.now().isoformat(timespec='milliseconds'), "stage": name, "event": event}, **values)
+  with progress_lock:
+    if build_progress["file"] is not None:
+      build_progress["file"].write(json.dumps(entry) + "\n")
+      build_progress["file"].flush()
+    if event == "end" and name != "build":
+      build_progress["stages"].append(entry)
+
+def expect_progress(seconds):
+  with progress_lock:
+    build_progress["total"] += seconds
+
+def stage_finished(name, ts, duration, **values):
+  wall = (datetime.now() - ts).total_seconds()
+  with progress_lock:
+    build_progress["done"][name] = duration
+  report_progress(name, "end", wall=round(wall, 3), duration=duration, **values)
+
+def update_progress(stage, values):
+  try:
+    out_time = max(0.0, int(values.get("out_time_us", "0")) / 1e6)
+  except ValueError:
+    out_time = 0.0
+  speed = values.get("speed", "N/A").strip()
+  now = datetime.now()
+  with progress_lock:
+    build_progress["done"][stage["name"]] = min(out_time, stage["duration"]) if stage["duration"] > 0 else out_time
+    done = sum(build_progress["done"].values())
+    total = max(build_progress["total"], done)
+    elapsed = (now - build_progress["start"]).total_seconds()
+    eta = elapsed * (total - done) / done if done > 0 else None
+    printed = build_progress["printed"]
+    show = printed is None or (now - printed).total_seconds() >= 1.0
+    if show:
+      build_progress["printed"] = now
+  values = {"out_time": round(out_time, 3), "speed": speed, "elapsed": round(elapsed, 3), "eta": None if eta is None else round(eta, 3)}
+  report_progress(stage["name"], "progress", **values)
+  if show:
+    seta = "?" if eta is None else str(timedelta(seconds=int(eta)))
+    percent = 100.0 * done / total if total > 0 else 0.0
+    print(f"{stage['name']}: {timedelta(seconds=int(out_time))} of {timedelta(seconds=int(stage['duration']))}, speed {speed}, build {percent:.0f}%, ETA {seta}")
+
+def print_stage_timings():
+  if len(build_progress["stages"]) == 0:
+    return
+  print("stage timings:")
+  for entry in build_progress["stages"]:
+    wall = entry["wall"]
+    speed = f"{entry['duration']/wall:.2f}x" if entry["duration"] > 0 and wall > 0 else ""
+    print(f"  {entry['stage']:<32} {wall:9.2f} s  {entry['duration']:9.2f} s media  {speed}")
+
+def run_ffmpeg(stage, capture_errors=False, started=None):
+  # ffmpeg writes key=value progress blocks to stdout, every block ends with a progress= line;
+  # with capture_errors the stderr text is returned in p.errors instead of going to the console;
+  # every output of a stage belongs to the tool, so it is overwritten without a question
+  options = [option for option in ["-nostdin", "-y"] if option not in stage["command"]]
+  ffmpeg_cmds = stage["command"][:1] + options + ["-progress", "pipe:1", "-nostats"] + stage["command"][1:]
+  ts = datetime.now()
+  report_progress(stage["name"], "start", duration=stage["duration"])
+  errfile = tempfile.TemporaryFile(mode="w+t", encoding='utf-8', errors='replace') if capture_errors else None
+  p = subprocess.Popen(ffmpeg_cmds, cwd=projectFolder, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=errfile, encoding='utf-8', errors='replace')
+  if started:
+    started(p)
+  values = {}
+  for line in p.stdout:
+    key, _, value = line.strip().partition('=')
+    values[key] = value
+    if key == "progress":
+      update_progress(stage, values)
+      values = {}
+  usage = {}
+  if hasattr(os, "wait4"):
+    # the rusage of this ffmpeg process alone, so the progress file has CPU time and peak RSS per stage
+    _, status, rusage = os.wait4(p.pid, 0)
+    p.returncode = os.waitstatus_to_exitcode(status)
+    usage = {"cpu": round(rusage.ru_utime + rusage.ru_stime, 3), "max_rss_mb": round(rusage.ru_maxrss / 1024, 1)}
+  else:
+    p.wait()
+  p.errors = ""
+  if errfile:
+    errfile.seek(0)
+    p.errors = errfile.read()
+    errfile.close()
+  stage_finished(stage["name"], ts, stage["duration"], returncode=p.returncode, **usage)
+  return p
+
+def run_ffmpeg_parallel(stages, jobs):
+  with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+    results = list(executor.map(run_ffmpeg, stages))
+  failed = [stage["name"] for stage, p in zip(stages, results) if p.returncode != 0]
+  if len(failed) > 0:
+    raise RuntimeError(f"ffmpeg failed for {', '.join(failed)}")
+
+probe_cache = None
+probe_cache_modified = False
+probe_cache_lock = threading.Lock()
+
+def file_fingerprint(fname):
+  st = os.stat(fname)
+  fingerprint = {"size": st.st_size, "mtime": st.st_mtime_ns}
+  if probeCacheHash:
+    h = hashlib.sha1()
+    with open(fname, "rb") as f:
+      h.update(f.read(65536))
+      if st.st_size > 65536:
+        f.seek(max(65536, st.st_size - 65536))
+        h.update(f.read(65536))
+    fingerprint["hash"] = h.hexdigest()
+  return fingerprint
+
+def load_probe_cache():
+  global probe_cache
+  if probe_cache is None:
+    probe_cache = {}
+    if os.path.exists(probeCacheFileName):
+      try:
+        with open(probeCacheFileName, "rt") as f:
+          probe_cache = json.load(f)
+      except (ValueError, OSError) as e:
+        print(f"ignore probe cache {probeCacheFileName}: {e}")
+  return probe_cache
+
+def save_probe_cache():
+  global probe_cache_modified
+  with probe_cache_lock:
+    if not probe_cache_modified or not os.path.isdir(projectFolder):
+      return
+    tmpName = probeCacheFileName + ".tmp"
+    with open(tmpName, "wt") as f:
+      json.dump(probe_cache, f)
+    os.replace(tmpName, probeCacheFileName)
+    probe_cache_modified = False
+
+def probe_media(fname):
+  p = subprocess.run([ffprobe_name, '-v', 'error', '-print_format', 'json', '-show_streams', fname], encoding='utf-8',stdout=subprocess.PIPE)
+  try:
+    return json.loads(p.stdout).get("streams", [])
+  except ValueError:
+    return []
+
+def probe_streams(fname, use_cache=True):
+  if not use_cache:
+    return probe_media(fname)
+  global probe_cache_modified
+  key = os.path.abspath(fname)
+  fingerprint = file_fingerprint(fname)
+  with probe_cache_lock:
+    entry = load_probe_cache().get(key)
+  if entry and entry["fingerprint"] == fingerprint:
+    return entry["streams"]
+  streams = probe_media(fname)
+  with probe_cache_lock:
+    probe_cache[key] = {"fingerprint": fingerprint, "streams": streams}
+    probe_cache_modified = True
+  return streams
+
+def probe_packets(fname):
+  p = subprocess.run([ffprobe_name, '-v', 'error', '-select_streams', 'v:0', '-show_entries', 'packet=pts_time,flags', '-print_format', 'json', fname], encoding='utf-8', stdout=subprocess.PIPE)
+  try:
+    packets = json.loads(p.stdout).get("packets", [])
+  except ValueError:
+    return []
+  return sorted([float(pk["pts_time"]) for pk in packets if 'K' in pk.get("flags", "") and pk.get("pts_time", "N/A") != "N/A"])
+
+def probe_frame_count(fname):
+  p = subprocess.run([ffprobe_name, '-v', 'error', '-select_streams', 'v:0', '-count_packets', '-show_entries', 'stream=nb_read_packets', '-print_format', 'json', fname], encoding='utf-8', stdout=subprocess.PIPE)
+  try:
+    return int(json.loads(p.stdout)["streams"][0]["nb_read_packets"])
+  except (ValueError, KeyError, IndexError):
+    return None
+
+def probe_keyframes(fname):
+  # keyframe times relative to the stream start, as used by -ss, are kept in the probe cache entry of the file
+  global probe_cache_modified
+  streams = probe_streams(fname)
+  key = os.path.abspath(fname)
+  with probe_cache_lock:
+    entry = probe_cache.get(key)
+    if entry and "keyframes" in entry:
+      return entry["keyframes"]
+  start_time = 0.0
+  for strm in streams:
+    if strm.get("codec_type") == "video" and strm.get("start_time", "N/A") != "N/A":
+      start_time = float(strm["start_time"])
+      break
+  keyframes = [round(k - start_time, 6) for k in probe_packets(fname)]
+  with probe_cache_lock:
+    if key in probe_cache:
+      probe_cache[key]["keyframes"] = keyframes
+      probe_cache_modified = True
+  return keyframes
+
+def media_key(ifname, *params):
+  fingerprint = file_fingerprint(ifname) if os.path.exists(ifname) else None
+  key = json.dumps([os.path.abspath(ifname), fingerprint] + list(params), sort_keys=True)
+  return hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+
+def prefetch_probes(fnames):
+  fnames = sorted(filter(os.path.exists, fnames))
+  if len(fnames) == 0:
+    return
+  ts = datetime.now()
+  with ThreadPoolExecutor(max_workers=max(1, probeJobs)) as executor:
+    list(executor.map(probe_streams, fnames))
+  stage_finished("probe", ts, 0.0, files=len(fnames))
+
+def fragment_key(ffmpeg_cmds):
+  h = hashlib.sha256()
+  h.update(intermediateExt.encode('utf-8'))
+  cmds = ffmpeg_cmds[:-1]
+  i = 0
+  while i < len(cmds):
+    if cmds[i] in ('-threads', '-filter_complex_threads'):
+      i += 2
+      continue
+    h.update(b'\0' + cmds[i].encode('utf-8'))
+    if i > 0 and cmds[i-1] == '-i' and os.path.exists(cmds[i]):
+      h.update(json.dumps(file_fingerprint(cmds[i]), sort_keys=True).encode('utf-8'))
+    i += 1
+  return h.hexdigest()
+
+def evict_fragment_cache(used):
+  if not os.path.isdir(fragmentCacheFolder):
+    return
+  files = []
+  total_size = 0
+  for file in os.listdir(fragmentCacheFolder):
+    fname = os.path.join(fragmentCacheFolder, file)
+    name, ext = os.path.splitext(file)
+    # only fragment_key names are entries, anything else in the folder is left alone
+    if not re.fullmatch(r"[0-9a-f]{64}", name) or not ext in ['.mp4', '.mov', '.mkv', '.nut', intermediateExt] or not os.path.isfile(fname):
+      continue
+    if ext != intermediateExt:
+      # left from another INTERMEDIATE_EXT, such entries are never looked up again
+      print('evict', fname)
+      os.remove(fname)
+      continue
+    st = os.stat(fname)
+    files.append((st.st_mtime, st.st_size, fname))
+    total_size += st.st_size
+  limit = fragmentCacheSize * 1024 * 1024
+  for mtime, size, fname in sorted(files):
+    if total_size <= limit:
+      break
+    if fname in used:
+      continue
+    print('evict', fname)
+    os.remove(fname)
+    total_size -= size
+
+def frames_duration(deltat, rates):
+  # frames generated by the first rate while pts < deltat, resampled by each next fps conversion
+  nframes = math.ceil(deltat * rates[0] - 1e-9)
+  for irate, orate in zip(rates[:-1], rates[1:]):
+    nframes = int(math.floor(nframes * orate / irate + 0.5))
+  return round(nframes * videoTimebase / rates[-1]) / videoTimebase
+
+def scaled_offset(v):
+  # keeps small non-zero offsets visible in preview renders
+  if v == 0:
+    return 0
+  return int(math.copysign(max(1, round(abs(v)*renderScale)), v))
+
 def cleanTemporaryFolder():
-  for file in filter(lambda x: os.path.splitext(x)[1] == videoExt or os.path.splitext(x)[1] == ".txt", os.listdir(temporaryFolder)):
-    if args.soundOnly and file == "video_temp" + videoExt:
+  for file in filter(lambda x: os.path.splitext(x)[1] in [videoExt, intermediateExt, ".txt"], os.listdir(temporaryFolder)):
+    if args.soundOnly and file.startswith("temp_") and os.path.splitext(file)[1] == intermediateExt:
       print("skip", file)
       continue
     print('delete', os.path.join(temporaryFolder, file))
@@ -198,12 +650,14 @@ class FFText:
     filter_strs += [f"fontcolor={self.color}"]
     if not(self.scolor is None):
       filter_strs += [f"shadowcolor={self.scolor}"]
-      filter_strs += [f"shadowx={self.shadowx}"]
-      filter_strs += [f"shadowy={self.shadowy}"]
+      filter_strs += [f"shadowx={scaled_offset(self.shadowx)}"]
+      filter_strs += [f"shadowy={scaled_offset(self.shadowy)}"]
+    size0 = f"{self.size0*renderScale:g}"
+    size1 = f"{self.size1*renderScale:g}"
     if self.size1 == self.size0:
-      filter_strs += [f"fontsize={self.size0}"]
+      filter_strs += [f"fontsize={size0}"]
     else:
-      filter_strs += [f"fontsize={self.size0}+t*({self.size1}-{self.size0})/{deltat}"]
+      filter_strs += [f"fontsize={size0}+t*({size1}-{size0})/{deltat}"]
     if ft > 0:
       filter_strs += [f"alpha='if(lt(t,{ts}),0,if(lt(t,{ta}),(t-{ts})/{ft},if(lt(t,{tb}),1,if(lt(t,{te}),({tb}-t+{ft})/{ft},0))))'"]
     else:
@@ -253,6 +707,7 @@ class FFText:
 class FFSound:
   index = -1
   isound = -1
+  ainput = ''
   tstart = 0.0
   tend = 0.0
   vstart = 0.0
@@ -262,33 +717,24 @@ class FFSound:
   svolume = 0.0
   istart = -1
   iend = -1
+  icue = -1
+  lane = -1
+  toffset = 0.0
+  delay = 0
   sound_filter = ""
   voutname = ""
   aoutname = ""
   duration = 0.0
   asample_rate = audioSampleRate
   deltat = 0.0
-  silent = False
 
 
   def parseAudioInfo(self):
     if not os.path.exists(self.fname):
       return
-    p = subprocess.run([ffprobe_name, '-v', 'error', '-show_streams', self.fname], encoding='utf-8',stdout=subprocess.PIPE)
-    streams_info = p.stdout.lstrip().rstrip().split('\n')
-    streams = []
-    for sval in streams_info:
-      if sval == "[STREAM]":
-        streams.append([])
-        continue
-      if len(streams) > 0:
-        streams[-1].append(sval.split("="))
-    for strm in streams:
-     if len(list(filter(lambda x: len(x) > 1 and x[0].lstrip().rstrip() =="codec_type" and x[1].lstrip().rstrip() == "audio", strm))) > 0:
-       for vals in strm:
-        if len(vals) < 2:
-          continue
-        key, value = vals[0].lstrip().rstrip(), vals[1].lstrip().rstrip()
+    for strm in probe_streams(self.fname):
+     if strm.get("codec_type") == "audio":
+       for key, value in strm.items():
         if key == "sample_rate":
           self.asample_rate = int(value)
         if key == "duration":
@@ -301,9 +747,6 @@ class FFSound:
        self.deltat += ffcmds_list[i].part_deltat()
     self.tend += self.deltat
  
-  def update_index(self, isound):
-    self.isound = isound
-
   def __repr__(self):
     s = []
     keys = set()
@@ -321,15 +764,8 @@ class FFSound:
     return f"{self.index}: " + " ".join(s)
 
 
-  def ffmpeg_file(self):
-    return ['-i', self.fname]
-
-  def ffsilent_filter(self):
-    self.aoutname = f"asnd{self.index}"
-    self.sound_filter = f"anullsrc=r={self.asample_rate}:cl=stereo:d={self.deltat}[{self.aoutname}]"
-
   def split_by_fade(self):
-    if self.silent or self.tfade <= 0:
+    if self.tfade <= 0:
       return None
     if self.deltat < 2*self.tfade:
       raise ValueError(f"audio time duration {self.deltat} less then fade time {self.tfade} at position {self.istart}")
@@ -342,7 +778,7 @@ class FFSound:
     v2 = 1.0
     v3 = 0.0
     ffsnds = []
-    ffsnd01 = deepcopy(self)
+    ffsnd01 = copy(self)
     ffsnd01.tstart = t0
     ffsnd01.tend = t1
     ffsnd01.vstart = v0
@@ -350,14 +786,16 @@ class FFSound:
     ffsnd01.deltat = t1 - t0
     ffsnds += [ffsnd01]
     if t2 > t1:
-      ffsnd12 = deepcopy(self)
+      ffsnd12 = copy(self)
+      ffsnd12.toffset = self.toffset + t1 - t0
       ffsnd12.tstart = t1
       ffsnd12.tend = t2
       ffsnd12.vstart = v1
       ffsnd12.vend = v2
       ffsnd12.deltat = t2 - t1
       ffsnds += [ffsnd12]
-    ffsnd23 = deepcopy(self)
+    ffsnd23 = copy(self)
+    ffsnd23.toffset = self.toffset + t2 - t0
     ffsnd23.tstart = t2
     ffsnd23.tend = t3
     ffsnd23.vstart = v2
@@ -371,14 +809,15 @@ class FFSound:
     ffsnds = [None, None]
     vcenter = self.vstart + (self.vend - self.vstart) * dt0 / self.deltat
     if dt0 > 0:
-      ffsnds[0] = deepcopy(self)
+      ffsnds[0] = copy(self)
       ffsnds[0].tstart = self.tstart
       ffsnds[0].tend = self.tstart + dt0
       ffsnds[0].deltat = dt0
       ffsnds[0].vstart = self.vstart
       ffsnds[0].vend = vcenter
     if dt1 > 0:
-      ffsnds[1] = deepcopy(self)
+      ffsnds[1] = copy(self)
+      ffsnds[1].toffset = self.toffset + dt0
       ffsnds[1].tstart = self.tstart + dt0
       ffsnds[1].tend = self.tend
       ffsnds[1].deltat = dt1
@@ -387,63 +826,23 @@ class FFSound:
     return ffsnds
 
 
+  def looped(self):
+    return self.duration > 0 and self.tend > self.duration + 1e-6
+
   def ffmpeg_filter(self):
-    if self.silent:
-      self.ffsilent_filter()
-      return
+    # offsets are continuous, a looped file is opened with -stream_loop so a cue plays on past its end
+    if self.tend < self.tstart:
+      raise ValueError(f"audio time {self.tstart} {self.tend} incorrect for {self.fname} at position {self.istart}")
     asndname = f"asnd{self.index}"
-    t0 = self.tstart
-    t1 = self.tend
-    if t1 < t0:
-      raise ValueError(f"audio time {t0} {t1} incorrect for {self.fname} at position {self.istart}")
-    tt = [[t0, t1, self.vstart, self.vend]]
-    i = 0
-    while i < len(tt):
-      if tt[i][1] < tt[i][0]:
-        raise ValueError(f"audio time segment {tt[i][0]} - {tt[i][1]} incorrect for {self.fname} at position {self.istart}")
-      if tt[i][1]-tt[i][0]==0:
-        del tt[i]
-        continue
-      if tt[i][0] >= self.duration:
-        for j in range(i, len(tt)):
-          tt[j][0] -= self.duration
-          tt[j][1] -= self.duration
-        continue
-      if tt[i][1] > self.duration:
-        t0 = tt[i][0]
-        t1 = tt[i][1]
-        v0 = tt[i][2]
-        v1 = tt[i][3]
-        vd = v0 + (v1 - v0) * (self.duration - t0) / (t1 - t0)
-        del tt[i]
-        tt.insert(i, [t0, self.duration, v0, vd])
-        tt.insert(i+1, [0.0, t1-self.duration, vd, v1])
-        for j in range(i+2, len(tt)):
-          tt[j][0] -= duration
-          tt[j][1] -= duration
-      i += 1
-    ffsnd_filters = []
-    avnames = []
-    for i, t in enumerate(tt):
-      avname = f"asnd{self.index}_{i}"
-      if len(tt) == 1:
-        avname = asndname
-      t0 = t[0]
-      t1 = t[1]
-      v0 = t[2]
-      v1 = t[3]
-      tfilters = [ f"[{self.isound}:a]atrim=start={t0}:end={t1},asetpts=PTS-STARTPTS,volume={self.svolume}" ]
-      if v1 > v0:
-        tfilters += [ f"afade=t=in:d={t1-t0}:silence={v0}:unity={v1}" ]
-      elif v1 < v0:
-        tfilters += [ f"afade=t=out:d={t1-t0}:silence={v1}:unity={v0}" ]
-      tfilters += [f"aresample={self.asample_rate}"]
-      ffsnd_filters += [ ",".join(tfilters) + f"[{avname}]" ]
-      avnames += [ f"[{avname}]" ]
-    if len(tt) > 1:
-      ffsnd_filters += ["".join(avnames) + f"concat=n={len(avnames)}:v=0:a=1[{asndname}]"]
+    ainput = self.ainput if self.ainput else f"{self.isound}:a"
+    tfilters = [ f"[{ainput}]atrim=start={self.tstart}:end={self.tend},asetpts=PTS-STARTPTS,volume={self.svolume}" ]
+    if self.vend > self.vstart:
+      tfilters += [ f"afade=t=in:d={self.tend-self.tstart}:silence={self.vstart}:unity={self.vend}" ]
+    elif self.vend < self.vstart:
+      tfilters += [ f"afade=t=out:d={self.tend-self.tstart}:silence={self.vend}:unity={self.vstart}" ]
+    tfilters += [f"aresample={self.asample_rate}"]
     self.aoutname = asndname
-    self.sound_filter = ";".join(ffsnd_filters)
+    self.sound_filter = ",".join(tfilters) + f"[{asndname}]"
 
 class FFBase:
   index = -1
@@ -474,20 +873,10 @@ class FFBase:
     self.ifname = ifname
     self.tvideo = tvideo
  
-  def parseVideoInfo(self, streams_info):
-    streams = []
-    for sval in streams_info:
-      if sval == "[STREAM]":
-        streams.append([])
-        continue
-      if len(streams) > 0:
-        streams[-1].append(sval.split("="))
+  def parseVideoInfo(self, streams):
     for strm in streams:
-      if len(list(filter(lambda x: len(x) > 1 and x[0].lstrip().rstrip() =="codec_type" and x[1].lstrip().rstrip() == "video", strm))) > 0:
-        for vals in strm:
-          if len(vals) < 2:
-            continue
-          key, value = vals[0].lstrip().rstrip(), vals[1].lstrip().rstrip()
+      if strm.get("codec_type") == "video":
+        for key, value in strm.items():
           if key == "width":
             if self.tvideo:
               self.width = int(value)
@@ -507,17 +896,16 @@ class FFBase:
               self.duration = float(value)
           except ValueError:
             pass
-      elif len(list(filter(lambda x: len(x) > 1 and x[0].lstrip().rstrip() =="codec_type" and x[1].lstrip().rstrip() == "audio", strm))) > 0:
+      elif strm.get("codec_type") == "audio":
         self.nosound = False
-        for vals in strm:
-          if len(vals) < 2:
-            continue
-          key, value = vals[0].lstrip().rstrip(), vals[1].lstrip().rstrip()
+        for key, value in strm.items():
           if key == "sample_rate":
             self.asample_rate = int(value)
  
 class FFCmd(FFBase):
   icmd = -1
+  vinput = ''
+  ainput = ''
   fname = ''
   snapshot_name = ''
   tdelta = ''
@@ -544,31 +932,15 @@ class FFCmd(FFBase):
   def __init__(self, iline, index, ifname, tvideo):
     super().__init__(index, ifname, tvideo)
     self.iline = iline
-    self.fname = os.path.join(workingFolder, partPrefix + "_" + str(self.index) + videoExt)
     #print(f"FFCmd.ifname = {self.ifname}")
     if os.path.exists(self.ifname):
-      p = subprocess.run([ffprobe_name, '-v', 'error', '-show_streams', self.ifname], encoding='utf-8',stdout=subprocess.PIPE)
-      streams_info = p.stdout.lstrip().rstrip().split('\n')
-      self.parseVideoInfo(streams_info)
-    self.parseVideoPart()
+      self.parseVideoInfo(probe_streams(self.ifname))
     #print(f"FFCmd.framerate = {self.framerate}")
 
-  def extractDuration(self, filename):
-      p = subprocess.run([ffprobe_name, '-v', 'error', '-show_streams', filename], encoding='utf-8',stdout=subprocess.PIPE)
-      streams_info = p.stdout.lstrip().rstrip().split('\n')
-      streams = []
-      for sval in streams_info:
-        if sval == "[STREAM]":
-          streams.append([])
-          continue
-        if len(streams) > 0:
-          streams[-1].append(sval.split("="))
-      for strm in streams:
-        if len(list(filter(lambda x: len(x) > 1 and x[0].lstrip().rstrip() =="codec_type" and x[1].lstrip().rstrip() == "video", strm))) > 0:
-          for vals in strm:
-            if len(vals) < 2:
-              continue
-            key, value = vals[0].lstrip().rstrip(), vals[1].lstrip().rstrip()
+  def extractDuration(self, filename, use_cache=True):
+      for strm in probe_streams(filename, use_cache):
+        if strm.get("codec_type") == "video":
+          for key, value in strm.items():
             try:
               if key == "duration" and self.part_duration == 0:
                 self.part_duration = float(value)
@@ -578,7 +950,11 @@ class FFCmd(FFBase):
               pass
  
   def parseVideoPart(self):
-    if os.path.exists(self.fname) and self.tvideo:
+    if not self.tvideo or args.cutMode == "direct":
+      return
+    params = [self.tstart, self.tdelta] + ([args.cutMode] if args.cutMode != "copy" else [])
+    self.fname = os.path.join(workingFolder, partPrefix + "_" + media_key(self.ifname, *params) + videoExt)
+    if os.path.exists(self.fname):
       self.extractDuration(self.fname)
 
 
@@ -586,6 +962,25 @@ class FFCmd(FFBase):
     if not self.create_out:
       print("fragment {self.index} does not produce output")
       return
+    if self.tcolor:
+      rates = [colorSourceRate, self.framerate, frameRate]
+    elif self.tvideo:
+      rates = [self.framerate, self.framerate]
+    else:
+      rates = [self.framerate, self.framerate, frameRate]
+    # part_duration of a video is in source time, part_deltat divides it by the speed
+    self.part_duration = frames_duration(self.deltat * (self.frate if self.tvideo else 1.0), rates)
+    if args.verifyDuration and not self.tvideo:
+      part_duration = self.part_duration
+      self.part_duration = 0.0
+      self.encodeDuration()
+      if self.part_duration == 0:
+        self.part_duration = part_duration
+      elif math.fabs(self.part_duration - part_duration) > 1e-3:
+        print(f"warning: part {self.index} at {self.iline} encoded duration {self.part_duration} differs from calculated {part_duration}")
+    print(f"part {self.index} duration = {self.part_duration}")
+
+  def encodeDuration(self):
     cofile = os.path.join(temporaryFolder, "color_fragment" +  videoExt)
     tsfile = os.path.join(temporaryFolder, "snapshot_fragment.jpg")
     ffmpeg_cmds = [ffmpeg_name]
@@ -611,12 +1006,11 @@ class FFCmd(FFBase):
     subprocess.run(ffmpeg_cmds, cwd=projectFolder)
     ffcmd_str =  " ".join(ffmpeg_cmds)
     print("create temp. mp4 file: " + ffcmd_str)
-    self.extractDuration(cofile)
+    self.extractDuration(cofile, False)
     if os.path.exists(cofile):
       os.remove(cofile)
     if os.path.exists(tsfile):
       os.remove(tsfile)
-    print(f"part {self.index} duration = {self.part_duration}")
 
 
 
@@ -650,14 +1044,121 @@ class FFCmd(FFBase):
       s += [f"{k}={v}"]
     return f"{self.index}: " + " ".join(s)
 
-  def cut_video_part(self):
-    cmdarr = None
+  def cut_entry(self):
+    fingerprint = file_fingerprint(self.ifname) if os.path.exists(self.ifname) else None
+    entry = {"source": os.path.abspath(self.ifname), "fingerprint": fingerprint, "tstart": self.tstart, "tdelta": self.tdelta if self.tvideo else ""}
+    if self.tvideo and args.cutMode != "copy":
+      entry["mode"] = args.cutMode
+    return entry
+
+  def cut_video_cmds(self):
     if self.tsnap and self.createSnapshot:
-      cmdarr = [ffmpeg_name, '-ss', self.tstart, '-i', self.ifname, '-frames:v', '1', '-q:v', '2', '-update', 'true', self.snapshot_name]
-    elif self.tvideo:
-      cmdarr = [ffmpeg_name, '-ss', self.tstart,  '-i', self.ifname, '-c', 'copy', '-t', self.tdelta, self.fname]
-    if cmdarr:
-      subprocess.run(cmdarr, cwd=projectFolder)
+      return [ffmpeg_name, '-y', '-nostdin', '-ss', self.tstart, '-i', self.ifname, '-frames:v', '1', '-q:v', '2', '-update', 'true', self.snapshot_name]
+    elif self.tvideo and args.cutMode != "direct":
+      return [ffmpeg_name, '-y', '-nostdin', '-ss', self.tstart,  '-i', self.ifname, '-c', 'copy', '-t', self.tdelta, self.fname]
+    return None
+
+  def smart_cut_encode(self, t0, dt, ofile):
+    vcodec, pix_fmt = "libx264", "yuv420p"
+    for strm in probe_streams(self.ifname):
+      if strm.get("codec_type") == "video":
+        vcodec = "libx265" if strm.get("codec_name") == "hevc" else "libx264"
+        pix_fmt = strm.get("pix_fmt", pix_fmt)
+        break
+    return [ffmpeg_name, '-y', '-nostdin', '-ss', f"{t0:.6f}", '-i', self.ifname, '-t', f"{dt:.6f}", '-c:v', vcodec, '-preset', smartCutPreset, '-crf', f"{smartCutCrf}",
+            '-pix_fmt', pix_fmt, '-c:a', 'aac', '-b:a', deliveryAbitrate] + (['-f', 'mpegts'] if ofile.endswith(".ts") else []) + [ofile]
+
+  def smart_cut_cmds(self):
+    # only the partial GOPs before the first and after the last keyframe of the cut are encoded, the rest is copied
+    # up to just before k1, where the tail starts; pieces are joined as mpegts, which repeats the parameter sets of both encoders in band
+    t0 = read_in_seconds(self.tstart)
+    t1 = t0 + read_in_seconds(self.tdelta)
+    eps = 1e-3
+    streams = probe_streams(self.ifname)
+    vcodec = next((strm.get("codec_name") for strm in streams if strm.get("codec_type") == "video"), None)
+    acodec = next((strm.get("codec_name") for strm in streams if strm.get("codec_type") == "audio"), "aac")
+    if vcodec not in ("h264", "hevc") or acodec != "aac":
+      # the encoded ends would not match the copied codecs, so the whole cut is encoded
+      return [self.smart_cut_encode(t0, t1 - t0, self.fname)], []
+    keyframes = probe_keyframes(self.ifname)
+    k0 = next((k for k in keyframes if k >= t0 - eps), None)
+    k1 = next((k for k in reversed(keyframes) if k <= t1 + eps), None)
+    base = os.path.splitext(self.fname)[0]
+    if k0 is None or k1 is None or k1 - k0 < eps:
+      return [self.smart_cut_encode(t0, t1 - t0, self.fname)], []
+    cmds = []
+    pieces = []
+    if k0 - t0 > eps:
+      pieces.append(base + "_head.ts")
+      cmds.append(self.smart_cut_encode(t0, k0 - t0, pieces[-1]))
+    pieces.append(base + "_copy.ts")
+    cmds.append([ffmpeg_name, '-y', '-nostdin', '-ss', f"{k0 + eps:.6f}", '-i', self.ifname, '-t', f"{k1 - k0 - eps:.6f}", '-c', 'copy', '-f', 'mpegts', pieces[-1]])
+    if t1 - k1 > eps:
+      pieces.append(base + "_tail.ts")
+      cmds.append(self.smart_cut_encode(k1, t1 - k1, pieces[-1]))
+    if len(pieces) == 1:
+      cmds[0][-3:] = [self.fname]
+      return cmds, []
+    cmds.append([ffmpeg_name, '-y', '-nostdin', '-i', 'concat:' + '|'.join(pieces), '-c', 'copy', self.fname])
+    return cmds, pieces
+
+  def cut_commands(self):
+    if self.tvideo and args.cutMode == "smart":
+      return self.smart_cut_cmds()
+    cmdarr = self.cut_video_cmds()
+    return ([cmdarr] if cmdarr else []), []
+
+  def cut_stages(self):
+    cmds, pieces = self.cut_commands()
+    if len(cmds) == 0:
+      return [], pieces
+    name = "cut_" + os.path.basename(cmds[-1][-1])
+    duration = 0.0 if self.tsnap else self.deltat * self.frate
+    stages = []
+    for i, cmdarr in enumerate(cmds):
+      dt = duration
+      if '-t' in cmdarr:
+        value = cmdarr[cmdarr.index('-t')+1]
+        dt = float(value) if re.fullmatch(r"[0-9.]+", value) else read_in_seconds(value)
+      stages.append(plan_stage(name + (f"_{i}" if i < len(cmds)-1 else ""), cmdarr, dt))
+    return stages, pieces
+
+  def cut_video_part(self):
+    stages, pieces = self.cut_stages()
+    if len(stages) == 0:
+      return None
+    expect_progress(sum([stage["duration"] for stage in stages]))
+    try:
+      for stage in stages:
+        p = run_ffmpeg(stage, capture_errors=True)
+        ofile = stage["command"][-1]
+        if p.returncode != 0 or not os.path.exists(ofile):
+          reason = p.errors.strip().split('\n')[-1] if p.errors.strip() else f"exit code {p.returncode}"
+          raise RuntimeError(f"{self.iline} {self.ifname} cut failed: {reason}")
+      if self.tvideo and args.cutMode == "smart":
+        self.verify_smart_cut()
+    finally:
+      for piece in pieces:
+        if os.path.exists(piece):
+          os.remove(piece)
+    return os.path.getsize(ofile)
+
+  def verify_smart_cut(self):
+    # a frame repeated or lost at a seam between the pieces changes the frame count of the clip
+    rate = next((strm.get("r_frame_rate", "") for strm in probe_streams(self.ifname) if strm.get("codec_type") == "video"), "")
+    num, _, den = rate.partition('/')
+    nframes = probe_frame_count(self.fname)
+    if not num.isdigit() or not den.isdigit() or int(num) == 0 or int(den) == 0 or nframes is None:
+      return
+    fps = int(num) / int(den)
+    t0 = read_in_seconds(self.tstart)
+    t1 = t0 + read_in_seconds(self.tdelta)
+    if self.duration > 0:
+      t1 = min(t1, self.duration)
+    expected = math.ceil(t1 * fps - 1e-3) - math.ceil(t0 * fps - 1e-3)
+    if nframes != expected:
+      os.remove(self.fname)
+      raise RuntimeError(f"{self.iline} {self.ifname} smart cut has {nframes} frames, expected {expected}")
 
 
 
@@ -679,7 +1180,9 @@ class FFCmd(FFBase):
     video_filters = []
     audio_filters = []
     if self.tvideo:
-      video_filters += [f"[{self.icmd}:v]setpts=({1.0/self.frate})*(PTS-STARTPTS)"]
+      video_filters += [f"[{self.vinput}]setpts=({1.0/self.frate})*(PTS-STARTPTS)"]
+      if renderScale != 1.0:
+        video_filters += [f"scale={self.width}:{self.height}"]
       if self.crop:
         cw = int(self.width*self.cropw/100)
         ch = int(self.height*self.croph/100)
@@ -690,12 +1193,12 @@ class FFCmd(FFBase):
       if self.nosound:
         audio_filters += [f"anullsrc=r={self.asample_rate}:cl=stereo:d={self.deltat}"]
       else:
-        audio_filters += [f"[{self.icmd}:a]atempo={self.frate},volume={self.volume}"]
+        audio_filters += [f"[{self.ainput}]atempo={self.frate},volume={self.volume}"]
     elif self.tcolor:
       video_filters += [f"color={self.color}:s={self.width}x{self.height}:d={self.deltat},fps={self.framerate},setsar=1"]
       audio_filters += [f"anullsrc=r={self.asample_rate}:cl=stereo:d={self.deltat}"]
     else: # image
-      video_prefix = f"[{self.icmd}:v]"
+      video_prefix = f"[{self.vinput}]"
       if self.crop:
         cw = int(self.iwidth*self.cropw/100)
         ch = int(self.iheight*self.croph/100)
@@ -728,13 +1231,42 @@ class FFCmd(FFBase):
 
   def update_index(self, icmd):
     self.icmd = icmd
+    self.vinput, self.ainput = f"{icmd}:v", f"{icmd}:a"
+
+  def ffmpeg_source(self):
+    if self.tvideo and args.cutMode == "direct":
+      t0 = read_in_seconds(self.tstart)
+      return ("seek", self.ifname), t0, t0 + read_in_seconds(self.tdelta), not self.nosound
+    elif self.tvideo:
+      return ("file", self.fname), 0.0, None, not self.nosound
+    elif not self.tcolor:
+      if self.deltat <= 0:
+        raise ValueError(f"deltat in line {self.iline} is incorrect {self.deltat}")
+      return ("loop", self.snapshot_name if self.tsnap else self.ifname, self.framerate), 0.0, self.deltat, False
+    return None
+
+  def render_cost(self):
+    seconds = self.part_deltat() if self.create_out else self.deltat
+    frames = seconds * self.framerate * self.width * self.height / (1920 * 1080)
+    cost = frames
+    if self.tvideo:
+      cost += frames * self.frate
+    if self.crop:
+      cost += frames * 0.5
+    cost += frames * 0.25 * len(self.itexts)
+    if self.fadeup or self.fadedown:
+      cost += frames * 0.5
+    if not self.tcolor:
+      cost += inputCost
+    return cost
 
   def ffmpeg_file(self):
     if self.tvideo:
+      if args.cutMode == "direct":
+        # input seeking is frame accurate here because the part is decoded and filtered anyway
+        return ['-ss', self.tstart, '-t', self.tdelta, '-i', self.ifname]
       return ['-i', self.fname]
     elif not self.tcolor:
-      if self.deltat <= 0: 
-        raise ValueError(f"deltat in line {self.iline} is incorrect {self.deltat}")
       ifname = self.ifname
       if self.tsnap:
         ifname = self.snapshot_name
@@ -756,6 +1288,7 @@ class FFOverlay(FFBase):
   ovlh = 0
   scale = False
   ioverlay = -1
+  vinput = ''
   ioverlay_start = -1
   ioverlay_end = -1
   blank = False
@@ -764,9 +1297,7 @@ class FFOverlay(FFBase):
   def __init__(self, ifname, tvideo):
     super().__init__(-1, ifname, tvideo)
     if os.path.exists(ifname):
-      p = subprocess.run([ffprobe_name, '-v', 'error', '-show_streams', self.ifname], encoding='utf-8',stdout=subprocess.PIPE)
-      streams_info = p.stdout.lstrip().rstrip().split('\n')
-      self.parseVideoInfo(streams_info)
+      self.parseVideoInfo(probe_streams(self.ifname))
 
   def __repr__(self):
     s = []
@@ -817,6 +1348,24 @@ class FFOverlay(FFBase):
 
   def update_index(self, ioverlay):
     self.ioverlay = ioverlay
+    self.vinput = f"{ioverlay}:v"
+
+  def ffmpeg_source(self):
+    if self.blank:
+      return None
+    elif self.tvideo:
+      t0 = read_in_seconds(self.tstart)
+      return ("seek", self.ifname), t0, t0 + self.deltat * self.frate, False
+    return ("loop", self.ifname, None), 0.0, self.deltat, False
+
+  def render_cost(self):
+    frames = self.deltat * self.framerate * self.width * self.height / (1920 * 1080)
+    cost = frames * 2
+    if not self.blank:
+      cost += frames * (self.frate if self.tvideo else 0.5) + inputCost
+      if self.crop or self.scale:
+        cost += frames * 0.5
+    return cost
  
   def blank_filter(self):
     self.voutname = f"vovl{self.index}"
@@ -830,11 +1379,11 @@ class FFOverlay(FFBase):
     tstart = read_datetime(self.tstart)
     ddt0 = timedelta(seconds=dt0*self.frate)
     if dt0 > 0:
-      ffovls[0] = deepcopy(self)
+      ffovls[0] = copy(self)
       ffovls[0].deltat = dt0
       ffovls[0].tstart = self.tstart
     if dt1 > 0:
-      ffovls[1] = deepcopy(self)
+      ffovls[1] = copy(self)
       ffovls[1].deltat = dt1
       ffovls[1].tstart = datetime2string(tstart + ddt0)
     return ffovls
@@ -847,10 +1396,12 @@ class FFOverlay(FFBase):
     bkgnd = f"bkgnd{self.index}"
     deltat = self.deltat * self.frate
     vovlname = f"vovl{self.index}"
-    filters_prefix = f"[{self.ioverlay}:v]"
+    filters_prefix = f"[{self.vinput}]"
     tmp_filters = []
     if self.tvideo:
       tmp_filters += [f"trim=start=0:end={deltat},setpts=(PTS-STARTPTS)*({1.0/self.frate})"]
+      if renderScale != 1.0:
+        tmp_filters += [f"scale=iw*{renderScale}:ih*{renderScale}"]
     scale = self.scale
     sw,sh = 0,0
     if self.crop:
@@ -936,7 +1487,7 @@ def create_ffcmds(p, iline, index, bfadet=0.0):
       tsnap = True
       tvideo = False
       tcolor = False
-      snapshot_name = os.path.join(snapshotsFolder, f"snapshot_{index}.jpg")
+      snapshot_name = os.path.join(snapshotsFolder, "snapshot_" + media_key(ifname, st0) + ".jpg")
     if key == 'r':
       frate = float(value)
     if key == 'v':
@@ -1066,7 +1617,8 @@ def create_ffcmds(p, iline, index, bfadet=0.0):
     ffcmd3.snapshot_name = snapshot_name
     ffcmds.append(ffcmd3)
   for ffcmd in ffcmds:
-    if not ffcmd.tvideo and ffcmd.create_out:
+    ffcmd.parseVideoPart()
+    if (not ffcmd.tvideo or args.cutMode == "direct") and ffcmd.create_out:
       ffcmd.calculateDuration()
   return index, ffcmds, fadet
 
@@ -1252,6 +1804,26 @@ def apply_defines(defines, line):
     line = re.sub("{"+var+"}", val, line)
   return line
 
+def collect_media_files(parsed):
+  fnames = set()
+  for p in parsed:
+    if len(p) == 0:
+      continue
+    keys = p[1::2]
+    if 'ast' in keys:
+      fnames.add(os.path.join(soundsFolder, p[0]))
+    elif 'ovlim' in p[1:]:
+      fnames.add(os.path.join(imagesFolder, p[0]))
+    elif 'ovlts' in keys:
+      fnames.add(os.path.join(sourceFolder, p[0]))
+    elif 'aend' in keys or 'ovlend' in p[1:] or p[0] == 'color' or 'color' in keys:
+      continue
+    elif 'dt' in keys and not 'ss' in keys:
+      fnames.add(os.path.join(imagesFolder, p[0]))
+    else:
+      fnames.add(os.path.join(sourceFolder, p[0]))
+  return fnames
+
 def generate_ffcmds_list():
   texts = load_texts()
   index = 0
@@ -1262,6 +1834,7 @@ def generate_ffcmds_list():
   ffcmds_list = []
   ffsnds_list = []
   ffovls_list = []
+  ffsnds_open = []
   defines = {}
   with open(configFileName, 'rt') as f:
     parsed = []
@@ -1279,19 +1852,27 @@ def generate_ffcmds_list():
       l = apply_defines(defines, l)
       p = l.split()
       parsed.append(p)
+    prefetch_probes(collect_media_files(parsed))
     for i, p in enumerate(parsed):
       if len(p) == 0:
         continue
       s = create_ffsound(p, index)
       if s:
         if s == -1:
-          ffsnd = ffsnds_list[-1]
+          if len(ffsnds_open) == 0:
+            raise ValueError(f"aend in line {i+1} has no open sound")
+          fname = os.path.join(soundsFolder, p[0])
+          ffsnd = next((ffsnd for ffsnd in reversed(ffsnds_open) if ffsnd.fname == fname), None)
+          if ffsnd is None:
+            raise ValueError(f"aend in line {i+1} has no open sound {p[0]}")
           ffsnd.iend = index
+          ffsnds_open.remove(ffsnd)
         elif type(s) is FFSound:
           s.index = len(ffsnds_list)
           s.isound = isound
           isound += 1
           ffsnds_list.append(s)
+          ffsnds_open.append(s)
         continue
       o = create_ffoverlay(p, index)
       if o:
@@ -1325,6 +1906,10 @@ def generate_ffcmds_list():
       asample_rate = ffcmd.asample_rate
       framerate = ffcmd.framerate
       break
+  if args.preview:
+    width = int(width*renderScale)//2*2
+    height = int(height*renderScale)//2*2
+    framerate = min(framerate, frameRate)
   for ffcmd in ffcmds_list:
     ffcmd.texts = texts
     ffcmd.width = width
@@ -1345,10 +1930,10 @@ def generate_ffcmds_list():
       print(f'ffovl.tstart = {ffovl.tstart}')
     if ffovl.ioverlay_end > ffovl.ioverlay_start and ffovl.ioverlay_end-1 < len(ffcmds_list) and ffcmds_list[ffovl.ioverlay_end-1].fadet > 0:
       ffovl.ioverlay_end -= 1
-  i = 0
+  # gaps are filled while copying into new lists, inserting into the old ones is quadratic on big configs
+  ffovls_filled = []
   iprev = 0
-  while i < len(ffovls_list):
-    ffovl = ffovls_list[i]
+  for ffovl in ffovls_list:
     ffovl.width = width
     ffovl.height = height
     ffovl.vcodec = vcodec
@@ -1358,66 +1943,41 @@ def generate_ffcmds_list():
       o = FFOverlay("", False)
       o.ioverlay_start = iprev
       o.ioverlay_end = ffovl.ioverlay_start
-      iprev = ffovl.ioverlay_end
       o.blank = True
       o.width = width
       o.height = height
-      ffovls_list.insert(i, o)
-      i += 2
-    else:
-      iprev = ffovl.ioverlay_end
-      i += 1
-  if len(ffovls_list) > 0 and ffovls_list[-1].ioverlay_end < len(ffcmds_list):
+      ffovls_filled.append(o)
+    iprev = ffovl.ioverlay_end
+    ffovls_filled.append(ffovl)
+  if len(ffovls_filled) > 0 and ffovls_filled[-1].ioverlay_end < len(ffcmds_list):
     o = FFOverlay("", False)
-    o.ioverlay_start = ffovl.ioverlay_end
+    o.ioverlay_start = ffovls_filled[-1].ioverlay_end
     o.ioverlay_end = len(ffcmds_list)
     o.blank = True
     o.width = width
     o.height = height
-    ffovls_list.append(o)
-  i = 0
-  iprev = 0
-  while i < len(ffsnds_list):
-    ffsnd = ffsnds_list[i]
-    if ffsnd.silent:
-      raise IndexError(f"Sounds iteration error at {ffsnd.index}. Should not be Silent")
-    if ffsnd.istart > iprev:
-      s = FFSound()
-      s.istart = iprev
-      s.iend = ffsnd.istart
-      iprev = ffsnd.iend
-      s.silent = True
-      ffsnds_list.insert(i, s)
-      i += 2
-    else:
-      iprev = ffsnd.iend
-      i += 1
-  if len(ffsnds_list) > 0 and ffsnds_list[-1].iend < len(ffcmds_list):
-    s = FFSound()
-    s.istart = ffsnd.iend
-    s.iend = len(ffcmds_list)
-    s.silent = True
-    ffsnds_list.append(s)
+    ffovls_filled.append(o)
+  ffovls_list = ffovls_filled
+  # sounds are placed at the timeline time of their first line and mixed, so cues may overlap and gaps stay empty
+  times = [0.0]
+  for ffcmd in ffcmds_list:
+    times.append(times[-1] + (ffcmd.part_deltat() if ffcmd.create_out else 0.0))
+  for ffsnd in ffsnds_open:
+    ffsnd.iend = len(ffcmds_list)
   for i, ffsnd in enumerate(ffsnds_list):
-    ffsnd.index = i
+    ffsnd.index = ffsnd.icue = i
+    ffsnd.toffset = times[ffsnd.istart]
     ffsnd.calculate_deltat(ffcmds_list)
 #    print(ffsnd)
-  i = 0
-  while i < len(ffsnds_list):
-    ffsnd = ffsnds_list[i]
+  ffsnds_list = [ffsnd for ffsnd in ffsnds_list if ffsnd.deltat > 0]
+  ffsnds_faded = []
+  for ffsnd in ffsnds_list:
     ffsnds = ffsnd.split_by_fade()
-    if ffsnds:
-      del ffsnds_list[i]
-      for s in ffsnds:
-        ffsnds_list.insert(i, s)
-        i += 1
-    else:
-      i += 1
-  sound_deltat = 0.0
+    ffsnds_faded += ffsnds if ffsnds else [ffsnd]
+  ffsnds_list = ffsnds_faded
   for i, ffsnd in enumerate(ffsnds_list):
     ffsnd.index = i
     ffsnd.asample_rate = asample_rate
-    sound_deltat += ffsnd.deltat
   ovls_deltat = 0.0
   for i, ffovl in enumerate(ffovls_list):
     ffovl.index = i
@@ -1426,137 +1986,553 @@ def generate_ffcmds_list():
     ffovl.framerate = framerate
     ffovl.calculate_deltat(ffcmds_list)
     ovls_deltat += ffovl.deltat
-  if len(ffsnds_list) > 0 and math.fabs(total_deltat - sound_deltat) > 0.001:
-    raise RuntimeError(f"Total times of streams are different: total_deltat={total_deltat} sound_deltat={sound_deltat}")
   if len(ffovls_list) > 0 and math.fabs(total_deltat - ovls_deltat) > 0.001:
     raise RuntimeError(f"Total times of streams are different: total_deltat={total_deltat} overlays_deltat={ovls_deltat}")
 
   ovls_time = 0.0
+  cmds_time = 0.0
+  icmd = 0
   for ffovl in ffovls_list:
     if not ffovl.blank:
-      cmds_time = 0.0
-      for i in range(0, ffovl.ioverlay_start):
-        if ffcmds_list[i].create_out:
-          cmds_time += ffcmds_list[i].part_deltat()
+      while icmd < ffovl.ioverlay_start:
+        if ffcmds_list[icmd].create_out:
+          cmds_time += ffcmds_list[icmd].part_deltat()
+        icmd += 1
       print(f"overlay cmd index = {ffovl.ioverlay_start}, overlays time = {ovls_time}, cmd time = {cmds_time}")
     ovls_time += ffovl.deltat
 
-
+  save_probe_cache()
   return ffcmds_list, ffsnds_list, ffovls_list
 
+def range_sounds(ffsnds_list, t0, t1):
+  # sounds crossing the range ends are split, the rest keep their offsets relative to t0
+  ffsnds_range = []
+  for ffsnd in ffsnds_list:
+    if ffsnd.toffset + ffsnd.deltat <= t0 or ffsnd.toffset >= t1:
+      continue
+    if ffsnd.toffset < t0:
+      ffsnd = ffsnd.split_by_deltat(t0 - ffsnd.toffset)[1]
+    if ffsnd.toffset + ffsnd.deltat > t1:
+      ffsnd = ffsnd.split_by_deltat(t1 - ffsnd.toffset)[0]
+    ffsnd = copy(ffsnd)
+    ffsnd.toffset -= t0
+    ffsnds_range.append(ffsnd)
+  return ffsnds_range
+
+def select_range(ffcmds_list, ffovls_list, ffsnds_list, tfrom, tto):
+  # whole output groups covering [tfrom, tto] are rendered, the final stage trims them exactly
+  t = 0.0
+  igroup = 0
+  istart, iend = 0, 0
+  g0, g1 = None, 0.0
+  for i, ffcmd in enumerate(ffcmds_list):
+    if not ffcmd.create_out:
+      continue
+    t1 = t + ffcmd.part_deltat()
+    if g0 is None and t1 > tfrom:
+      istart, g0 = igroup, t
+    if g0 is not None:
+      iend, g1 = i + 1, t1
+      if t1 >= tto:
+        break
+    igroup = i + 1
+    t = t1
+  if g0 is None:
+    raise ValueError(f"range start {tfrom} is beyond video length {t}")
+  split_overlays(ffovls_list, g0)
+  if iend < len(ffcmds_list):
+    ffovls_list[:] = split_overlays(ffovls_list, g1 - g0)
+  ffsnds_list[:] = range_sounds(ffsnds_list, g0, g1)
+  print(f"render range {tfrom} - {min(tto, g1)} from commands {istart} - {iend-1} ({g0} - {g1})")
+  return ffcmds_list[istart:iend], (tfrom - g0, min(tto, g1) - tfrom)
+
+def take_overlays(ffovls_list, istart, cmds_duration):
+  # the overlay crossing cmds_duration is split, its rest replaces it in the list and becomes the next start
+  ovls_duration = 0.0
+  for i in range(istart, len(ffovls_list)):
+    ffovl = ffovls_list[i]
+    ovls_duration += ffovl.deltat
+    if ovls_duration > cmds_duration:
+      dt0 = ffovl.deltat - (ovls_duration-cmds_duration)
+      if dt0 < -1e-5:
+        print(f"ffovl.deltat={ffovl.deltat}, ovls_duration={ovls_duration}, cmds_duration={cmds_duration}")
+        raise ValueError(f"duration of overlay fragment at {ffovl.index} is incorrect {dt0}")
+      elif dt0 < 0:
+        dt0 = 0
+      ffovls = ffovl.split_by_deltat(dt0)
+      ffovls_curr = ffovls_list[istart:i]
+      if ffovls[0]:
+        ffovls_curr.append(ffovls[0])
+      if ffovls[1]:
+        ffovls_list[i] = ffovls[1]
+        return ffovls_curr, i
+      return ffovls_curr, i + 1
+  return [], istart
+
+def split_overlays(ffovls_list, cmds_duration):
+  ffovls_curr, i = take_overlays(ffovls_list, 0, cmds_duration)
+  del ffovls_list[:i]
+  return ffovls_curr
+
+def commands_costs(ffcmds_list, ffovls_list):
+  costs = [ffcmd.render_cost() for ffcmd in ffcmds_list]
+  spans = []
+  t = 0.0
+  for ffovl in ffovls_list:
+    if ffovl.deltat > 0:
+      spans.append((t, t + ffovl.deltat, ffovl.render_cost() / ffovl.deltat))
+    t += ffovl.deltat
+  j = 0
+  t = 0.0
+  for i, ffcmd in enumerate(ffcmds_list):
+    if not ffcmd.create_out:
+      continue
+    t0, t1 = t, t + ffcmd.part_deltat()
+    t = t1
+    while j < len(spans) and spans[j][1] <= t0:
+      j += 1
+    k = j
+    while k < len(spans) and spans[k][0] < t1:
+      costs[i] += (min(t1, spans[k][1]) - max(t0, spans[k][0])) * spans[k][2]
+      k += 1
+  return costs
+
+def count_fragment_sizes(ffcmds_list):
+  sizes = []
+  icurr = 0
+  while len(ffcmds_list) - icurr > fragment_size:
+    n = fragment_size
+    if not ffcmds_list[icurr+n-1].create_out:
+      n -= 1
+      if not ffcmds_list[icurr+n-1].create_out:
+        raise IndexError(f"two neighbour fragments in sequence don't generate output at {icurr+n-1}")
+    sizes.append(n)
+    icurr += n
+  if icurr < len(ffcmds_list):
+    sizes.append(len(ffcmds_list) - icurr)
+  return sizes
+
+def cost_fragment_sizes(ffcmds_list, ffovls_list):
+  costs = commands_costs(ffcmds_list, ffovls_list)
+  nfragments = min(len(ffcmds_list), max(math.ceil(len(ffcmds_list) / fragment_size), args.jobs))
+  remaining_cost = sum(costs)
+  target = remaining_cost / nfragments
+  max_size = 2 * fragment_size
+  sizes = []
+  istart = 0
+  fragment_cost = 0.0
+  for i, ffcmd in enumerate(ffcmds_list):
+    fragment_cost += costs[i]
+    if not ffcmd.create_out or i == len(ffcmds_list)-1:
+      continue
+    n = i + 1 - istart
+    if fragment_cost - costs[i]/2 >= target or n >= max_size:
+      sizes.append(n)
+      istart = i + 1
+      remaining_cost -= fragment_cost
+      fragment_cost = 0.0
+      target = remaining_cost / max(1, nfragments - len(sizes))
+  if istart < len(ffcmds_list):
+    sizes.append(len(ffcmds_list) - istart)
+  return sizes
+
 def split_fragments(ffcmds_list, ffovls_list):
   if fragment_size < 2:
     return [[ffcmds_list, ffovls_list]]
+  if fragmentSplit == "cost":
+    sizes = cost_fragment_sizes(ffcmds_list, ffovls_list)
+  else:
+    sizes = count_fragment_sizes(ffcmds_list)
   fragments = []
-  while len(ffcmds_list) > fragment_size:
-    n = fragment_size
-    if not ffcmds_list[n-1].create_out:
-      n -= 1
-      if not ffcmds_list[n-1].create_out:
-        raise IndexError(f"two neighbour fragments in sequence don't generate output at {icurr}")
-    ffcmds_curr = ffcmds_list[:n]
-    del ffcmds_list[:n]
+  icmd = 0
+  iovl = 0
+  for n in sizes[:-1]:
+    ffcmds_curr = ffcmds_list[icmd:icmd+n]
+    icmd += n
     cmds_duration = 0.0
     for ffcmd in ffcmds_curr:
       if ffcmd.create_out:
         cmds_duration += ffcmd.part_deltat()
-    ovls_duration = 0.0
-    ffovls_curr = []
-    for i, ffovl in enumerate(ffovls_list):
-      ovls_duration += ffovl.deltat
-      if ovls_duration > cmds_duration:
-        dt0 = ffovl.deltat - (ovls_duration-cmds_duration)
-        if dt0 < -1e-5:
-          print(f"ffovl.deltat={ffovl.deltat}, ovls_duration={ovls_duration}, cmds_duration={cmds_duration}")
-          raise ValueError(f"duration of overlay fragment at {ffovl.index} is incorrect {dt0}")
-        elif dt0 < 0:
-          dt0 = 0
-        ffovls = ffovl.split_by_deltat(dt0)
-        del ffovls_list[i]
-        ffovls_curr = ffovls_list[:i]
-        if ffovls[0]:
-          ffovls_curr.append(ffovls[0])
-        del ffovls_list[:i]
-        if ffovls[1]:
-          ffovls_list.insert(0, ffovls[1])
-        break
+    ffovls_curr, iovl = take_overlays(ffovls_list, iovl, cmds_duration)
     fragments += [[ffcmds_curr, ffovls_curr]]
-  if len(ffcmds_list) > 0:
-    fragments += [[ffcmds_list,  ffovls_list]]
+  if icmd < len(ffcmds_list):
+    fragments += [[ffcmds_list[icmd:],  ffovls_list[iovl:]]]
   return fragments
 
 
+def load_cut_manifest():
+  if os.path.exists(cutManifestFileName):
+    try:
+      with open(cutManifestFileName, "rt") as f:
+        return json.load(f)
+    except (ValueError, OSError) as e:
+      print(f"ignore cut manifest {cutManifestFileName}: {e}")
+  return {}
+
+def save_cut_manifest(manifest):
+  manifest = {k: v for k, v in manifest.items() if os.path.exists(os.path.join(projectFolder, k))}
+  tmpName = cutManifestFileName + ".tmp"
+  with open(tmpName, "wt") as f:
+    json.dump(manifest, f, indent=1, sort_keys=True)
+  os.replace(tmpName, cutManifestFileName)
+
+def cut_job(ffcmd, ofile, manifest):
+  ffcmd.verify()
+  if not ofile:
+    return None
+  name = os.path.relpath(ofile, projectFolder)
+  entry = ffcmd.cut_entry()
+  if os.path.exists(ofile) and manifest.get(name) == dict(entry, size=os.path.getsize(ofile)):
+    return name, None, os.path.getsize(ofile)
+  if debug_no_ffmpeg_exec:
+    ffcmd.cut_stages()
+    return None
+  size = ffcmd.cut_video_part()
+  return name, dict(entry, size=size), size
+
 def cut_all_videos():
+  open_progress()
   ffcmds_list, _, _ = generate_ffcmds_list()
+  manifest = load_cut_manifest()
+  jobs = max(1, args.cutJobs)
+  ts = datetime.now()
+  errors = []
+  ofiles = set()
+  nfiles, nbytes, nreused = 0, 0, 0
+  with ThreadPoolExecutor(max_workers=jobs) as executor:
+    futures = []
+    for ffcmd in ffcmds_list:
+      cmdarr = ffcmd.cut_video_cmds()
+      ofile = cmdarr[-1] if cmdarr and not cmdarr[-1] in ofiles else None
+      if ofile:
+        ofiles.add(ofile)
+      futures.append(executor.submit(cut_job, ffcmd, ofile, manifest))
+    for future in futures:
+      try:
+        r = future.result()
+      except Exception as e:
+        errors.append(e)
+        print("error: ", e)
+        continue
+      if r is None:
+        continue
+      name, entry, size = r
+      if entry is None:
+        nreused += 1
+        continue
+      manifest[name] = entry
+      nfiles += 1
+      nbytes += size
+  if not debug_no_ffmpeg_exec:
+    save_cut_manifest(manifest)
+  save_probe_cache()
+  dt = max((datetime.now() - ts).total_seconds(), 1e-6)
+  mbytes = nbytes / (1024 * 1024)
+  print(f"cut {nfiles} files, reused {nreused}, {mbytes:.1f} MB in {dt:.2f} s, jobs = {jobs}: {mbytes/dt:.1f} MB/s, {nfiles/dt:.1f} files/s")
+  close_progress()
+  if len(errors) > 0:
+    raise RuntimeError(f"{len(errors)} of {len(futures)} cut jobs failed")
+
+def make_snapshots(ffcmds_list):
+  ffcmds = {}
   for ffcmd in ffcmds_list:
-    ffcmd.verify()
-    ffcmd.cut_video_part()
-
-def make_sound(ffsnds_list, osfile):
+    if ffcmd.tsnap and ffcmd.createSnapshot and not os.path.exists(ffcmd.snapshot_name):
+      ffcmds[ffcmd.snapshot_name] = ffcmd
+  if debug_no_ffmpeg_exec:
+    for ffcmd in ffcmds.values():
+      ffcmd.cut_stages()
+    return
+  if len(ffcmds) == 0:
+    return
+  if not os.path.exists(snapshotsFolder):
+    os.makedirs(snapshotsFolder)
+  print(f"create {len(ffcmds)} snapshots")
+  with ThreadPoolExecutor(max_workers=max(1, args.cutJobs)) as executor:
+    list(executor.map(lambda ffcmd: ffcmd.cut_video_part(), ffcmds.values()))
+
+def sound_lanes(ffsnds_list):
+  # cues that do not overlap share a lane and follow each other with adelay for the gaps, lanes are mixed with amix
+  eps = 1e-6
+  cue_ends = {}
+  for ffsnd in ffsnds_list:
+    cue_ends[ffsnd.icue] = max(cue_ends.get(ffsnd.icue, 0.0), ffsnd.toffset + ffsnd.deltat)
+  ends = []
+  lanes = []
+  icue, ilane = None, -1
+  for ffsnd in ffsnds_list:
+    ffsnd.delay = 0
+    if ffsnd.icue != icue:
+      icue = ffsnd.icue
+      if len(ends) > 0 and ends[0][0] <= ffsnd.toffset + eps:
+        tend, ilane = heapq.heappop(ends)
+      else:
+        tend, ilane = 0.0, len(lanes)
+        lanes.append([])
+      ffsnd.delay = max(0, round(ffsnd.toffset * ffsnd.asample_rate) - round(tend * ffsnd.asample_rate))
+      heapq.heappush(ends, (cue_ends[icue], ilane))
+    ffsnd.lane = ilane
+    lanes[ilane].append(ffsnd)
+  return lanes
+
+def share_sound_inputs(ffsnds_list):
+  # cues of one lane that play a file forward are fed by one decode of it through asplit; a file played past its end
+  # is opened with -stream_loop, so a looped cue stays on one input; only a cue that goes back in the file opens the next pass
+  eps = 1e-6
+  passes = {}
+  inputs = []
+  for ffsnd in ffsnds_list:
+    key = (ffsnd.fname, ffsnd.lane)
+    last = passes.get(key)
+    if last is None or ffsnd.tstart < last[2] - eps:
+      last = passes[key] = [ffsnd.fname, [], ffsnd.tend, False]
+      inputs.append(last)
+    last[1].append(ffsnd)
+    last[2] = max(last[2], ffsnd.tend)
+    last[3] = last[3] or ffsnd.looped()
+  ffmpeg_files = []
+  ffmpeg_filters = []
+  for i, (fname, users, tend, looped) in enumerate(inputs):
+    ffmpeg_files += (['-stream_loop', '-1', '-t', f"{round(tend, 6)}"] if looped else []) + ['-i', fname]
+    labels = [f"{i}:a"]
+    if len(users) > 1:
+      labels = [f"snd{i}_{k}" for k in range(len(users))]
+      ffmpeg_filters.append(f"[{i}:a]asplit={len(users)}" + ''.join([f"[{label}]" for label in labels]))
+    for label, ffsnd in zip(labels, users):
+      ffsnd.isound = i
+      ffsnd.ainput = label
+  return ffmpeg_files, ffmpeg_filters
+
+def make_sound(ffsnds_list, osfile, duration, started=None):
   if len(ffsnds_list) == 0:
     raise ValueError("no sound to merge")
   ffmpeg_cmds = [ffmpeg_name]
-  ffmpeg_files = []
-  ffmpeg_filters = []
-  ffsnds_anames = []
-  indexFile = 0
+  lanes_anames = []
 #  print("ffsnds")
   for i, ffsnd in enumerate(ffsnds_list):
     ffsnd.index = i
-    ffsnd.update_index(indexFile)
-    if not ffsnd.silent:
-      ffmpeg_files += ffsnd.ffmpeg_file()
-      indexFile += 1
-  for ffsnd in ffsnds_list:
-    ffsnd.ffmpeg_filter()
-    ffmpeg_filters.append(ffsnd.sound_filter)
-    ffsnds_anames.append(f"[{ffsnd.aoutname}]")
-  asndname = ""
-  if len(ffsnds_anames) > 0:
-    n = len(ffsnds_anames)
-    asndname = "asnd"
-    ffsndconcat = ''.join(ffsnds_anames) + f"concat=n={n}:v=0:a=1[{asndname}]"
-    ffmpeg_filters.append(ffsndconcat)
+  lanes = sound_lanes(ffsnds_list)
+  ffmpeg_files, ffmpeg_filters = share_sound_inputs(ffsnds_list)
+  for ilane, lane in enumerate(lanes):
+    ffsnds_anames = []
+    for ffsnd in lane:
+      ffsnd.ffmpeg_filter()
+      ffmpeg_filters.append(ffsnd.sound_filter)
+      aname = ffsnd.aoutname
+      if ffsnd.delay > 0:
+        ffmpeg_filters.append(f"[{aname}]adelay=delays={ffsnd.delay}S:all=1[{aname}d]")
+        aname += "d"
+      ffsnds_anames.append(f"[{aname}]")
+    if len(ffsnds_anames) > 1:
+      ffmpeg_filters.append(''.join(ffsnds_anames) + f"concat=n={len(ffsnds_anames)}:v=0:a=1[lane{ilane}]")
+      ffsnds_anames = [f"[lane{ilane}]"]
+    lanes_anames += ffsnds_anames
+  asndname = "asnd"
+  n = len(lanes_anames)
+  amix = f"amix=inputs={n}:duration=longest:normalize=0," if n > 1 else ""
+  ffmpeg_filters.append(''.join(lanes_anames) + f"{amix}apad=whole_dur={duration}[{asndname}]")
   ffmpeg_cmds += ffmpeg_files
   filters_str = ';'.join(ffmpeg_filters)
   ffmpeg_cmds += ['-filter_complex', filters_str]
-  ffmpeg_cmds += ['-map', f"[{asndname}]", "-c:a", "aac",  osfile ]
+  ffmpeg_cmds += ['-map', f"[{asndname}]"] + intermediate_audio(ffsnds_list[0].asample_rate) + [osfile]
+  stage = plan_stage("sound", ffmpeg_cmds, duration)
   if not debug_no_ffmpeg_exec:
-    subprocess.run(ffmpeg_cmds, cwd=projectFolder)
+    p = run_ffmpeg(stage, started=started)
+    if p.returncode != 0:
+      raise RuntimeError(f"ffmpeg failed for {stage['name']}")
   ffcmd_str =  " ".join(ffmpeg_cmds)
   print(ffcmd_str)
-
-
-def merge_part(ffcmds_list, ffovls_list, framerate, ofile):
-  ffmpeg_cmds = [ffmpeg_name]
+  return stage
+
+
+def intermediate_video():
+  if len(intermediateVcodec) == 0:
+    return []
+  vcodec = ["-c:v", intermediateVcodec]
+  if intermediateVcodec in ["libx264", "libx265"]:
+    vcodec += ["-preset", intermediatePreset, "-crf", f"{intermediateCrf}"]
+  return vcodec
+
+def delivery_video(framerate, encode=False):
+  # fast intermediates are always encoded once for delivery, default intermediates are copied unless DELIVERY_ENCODE is set
+  if not encode and not deliveryEncode and len(intermediateVcodec) == 0:
+    return ["-c:v", "copy"]
+  vcodec = ["-c:v", deliveryVcodec, "-pix_fmt", deliveryPixFmt]
+  if deliveryVcodec in ["libx264", "libx265"]:
+    vcodec += ["-preset", deliveryPreset, "-crf", f"{deliveryCrf}"]
+  vcodec += ["-bf", f"{deliveryBframes}", "-force_key_frames", f"expr:gte(t,n_forced*{deliveryKeyint})"]
+  if framerate:
+    vcodec += ["-r", f"{framerate}"]
+  return vcodec
+
+def delivery_audio():
+  return ["-c:a", deliveryAcodec, "-b:a", deliveryAbitrate, "-ac", "2", "-ar", f"{deliveryAsampleRate}"]
+
+def parse_renditions(value):
+  ladder = []
+  for r in value.split(','):
+    if len(r) == 0:
+      continue
+    m = re.fullmatch(r"(\d+)[xX](\d+)(?::(\d+(?:\.\d+)?[kKmM]?))?", r.strip())
+    if not m:
+      raise ValueError(f"incorrect rendition {r}, expected WIDTHxHEIGHT or WIDTHxHEIGHT:BITRATE")
+    ladder.append((int(m.group(1)), int(m.group(2)), m.group(3) or ""))
+  return ladder
+
+def rendition_rate(i, bitrate):
+  if len(bitrate) == 0:
+    return []
+  m = re.fullmatch(r"(\d+(?:\.\d+)?)([kKmM]?)", bitrate)
+  if not m:
+    raise ValueError(f"incorrect rendition bitrate {bitrate}")
+  bufsize = f"{float(m.group(1))*2:g}{m.group(2)}"
+  return [f"-maxrate:v:{i}", bitrate, f"-bufsize:v:{i}", bufsize]
+
+def final_mux_cmds(listFile, osfile, framerate, ofile, trim=None):
+  # trimming is frame accurate only when decoding, so a trimmed range is always encoded
+  trim_cmds = []
+  if trim:
+    trim_cmds = ["-ss", f"{trim[0]}", "-t", f"{trim[1]}"]
+  ffmpeg_cmds = [ffmpeg_name, "-f", "concat", "-safe", "0"] + trim_cmds + ["-i", listFile]
+  if osfile:
+    ffmpeg_cmds += trim_cmds + ["-i", osfile]
+  ladder = parse_renditions(args.renditions)
+  amix = "[0:a][1:a]amix=2:shortest"
+  if len(ladder) == 0:
+    if osfile:
+      ffmpeg_cmds += ["-filter_complex", amix + "[aout]", "-map", "0:v", "-map", "[aout]"]
+    else:
+      ffmpeg_cmds += ["-map", "0:v", "-map", "0:a"]
+    ffmpeg_cmds += delivery_video(framerate, trim is not None) + delivery_audio()
+    ffmpeg_cmds += ["-video_track_timescale", f"{videoTimebase}", "-movflags", "faststart", ofile]
+    return ffmpeg_cmds, [ofile]
+  # the timeline is decoded once and split into scaled branches, all encoded by the same process
+  n = len(ladder)
+  naudio = 1 if args.streamFormat == "dash" else n
+  filters = ["[0:v]split=" + f"{n}" + ''.join([f"[vs{i}]" for i in range(n)])]
+  filters += [f"[vs{i}]scale={w}:{h},setsar=1[v{i}]" for i, (w, h, _) in enumerate(ladder)]
+  anames = [f"[a{i}]" for i in range(naudio)]
+  if osfile:
+    filters.append(amix + f",asplit={naudio}" + ''.join(anames))
+  else:
+    filters.append(f"[0:a]asplit={naudio}" + ''.join(anames))
+  ffmpeg_cmds += ["-filter_complex", ';'.join(filters)]
+  base = os.path.splitext(ofile)[0]
+  if args.streamFormat == "hls":
+    odir = base + "_hls"
+    for i in range(n):
+      ffmpeg_cmds += ["-map", f"[v{i}]", "-map", anames[i]]
+    ffmpeg_cmds += delivery_video(framerate, True) + delivery_audio()
+    for i, (_, _, bitrate) in enumerate(ladder):
+      ffmpeg_cmds += rendition_rate(i, bitrate)
+    var_stream_map = ' '.join([f"v:{i},a:{i},name:{h}p" for i, (_, h, _) in enumerate(ladder)])
+    ffmpeg_cmds += ["-f", "hls", "-hls_time", f"{segmentTime:g}", "-hls_playlist_type", "vod", "-hls_segment_filename", os.path.join(odir, "%v", "segment_%05d.ts"),
+                    "-master_pl_name", "master.m3u8", "-var_stream_map", var_stream_map, os.path.join(odir, "%v", "index.m3u8")]
+    return ffmpeg_cmds, [os.path.join(odir, "master.m3u8")] + [os.path.join(odir, f"{h}p", "index.m3u8") for _, h, _ in ladder]
+  if args.streamFormat == "dash":
+    odir = base + "_dash"
+    for i in range(n):
+      ffmpeg_cmds += ["-map", f"[v{i}]"]
+    ffmpeg_cmds += ["-map", anames[0]]
+    ffmpeg_cmds += delivery_video(framerate, True) + delivery_audio()
+    for i, (_, _, bitrate) in enumerate(ladder):
+      ffmpeg_cmds += rendition_rate(i, bitrate)
+    ffmpeg_cmds += ["-f", "dash", "-seg_duration", f"{segmentTime:g}", "-use_template", "1", "-use_timeline", "1",
+                    "-adaptation_sets", "id=0,streams=v id=1,streams=a", os.path.join(odir, "manifest.mpd")]
+    return ffmpeg_cmds, [os.path.join(odir, "manifest.mpd")]
+  outputs = []
+  for i, (_, h, bitrate) in enumerate(ladder):
+    rfile = base + f"_{h}p" + os.path.splitext(ofile)[1]
+    ffmpeg_cmds += ["-map", f"[v{i}]", "-map", anames[i]] + delivery_video(framerate, True) + delivery_audio() + rendition_rate(0, bitrate)
+    ffmpeg_cmds += ["-video_track_timescale", f"{videoTimebase}", "-movflags", "faststart", rfile]
+    outputs.append(rfile)
+  return ffmpeg_cmds, outputs
+
+def intermediate_audio(asample_rate):
+  # uncompressed audio in intermediates is stream-copied by concat and encoded to aac once in the last step
+  return ["-c:a", "pcm_s16le", "-ar", f"{asample_rate}", "-ac", "2"]
+
+def source_file(source, t0, t1):
+  if source[0] == "seek":
+    return ['-ss', f"{round(t0, 6)}", '-t', f"{round(t1 - t0, 6)}", '-i', source[1]]
+  elif source[0] == "loop":
+    return ['-loop', '1'] + (['-framerate', f"{source[2]}"] if source[2] else []) + ['-t', f"{round(t1, 6)}", '-i', source[1]]
+  return ['-i', source[1]]
+
+def share_inputs(ffobjs):
+  # consecutive parts reading one file (fade-in, body and fade-out of a line, adjacent lines) share a single input,
+  # fanned out with split/asplit and trimmed per part; they read it forward, so split only queues frames where
+  # neighbouring parts overlap, and a file used again further on opens its own input
+  eps = 1e-6
+  spans = []
+  for ffobj in ffobjs:
+    r = ffobj.ffmpeg_source()
+    if not r:
+      continue
+    source, p0, p1, audio = r
+    span = spans[-1] if len(spans) > 0 else None
+    if span and span[0] == source:
+      last = span[3][-1]
+      if source[0] == "loop":
+        # a looped image is the same at any offset, so the next part continues the loop
+        p0, p1 = span[2], span[2] + p1 - p0
+      if p1 is None:
+        shared = last[1] is None and last[3].iline == ffobj.iline
+      else:
+        shared = last[1] is not None and last[0] - eps <= p0 <= span[2] + eps
+      if shared:
+        span[2] = None if p1 is None else max(span[2], p1)
+        span[3].append((p0, p1, audio, ffobj))
+        continue
+    spans.append([source, p0, p1, [(p0, p1, audio, ffobj)]])
+  order = {id(ffobj): i for i, ffobj in enumerate(ffobjs)}
   ffmpeg_files = []
   ffmpeg_filters = []
+  for i, (source, t0, t1, parts) in enumerate(spans):
+    if len(parts) == 1:
+      parts[0][3].update_index(i)
+      ffmpeg_files += parts[0][3].ffmpeg_file()
+      continue
+    ffmpeg_files += source_file(source, t0, t1)
+    for stype, ftrim, fsplit in [("v", "trim", "split"), ("a", "atrim", "asplit")]:
+      users = [part for part in parts if stype == "v" or part[2]]
+      if len(users) == 0:
+        continue
+      labels = [f"{i}:{stype}"]
+      if len(users) > 1:
+        labels = [f"in{i}{stype}{j}" for j in range(len(users))]
+        ffmpeg_filters.append(f"[{i}:{stype}]{fsplit}={len(users)}" + ''.join([f"[{label}]" for label in labels]))
+      for label, (p0, p1, _, ffobj) in zip(labels, users):
+        if p1 is not None and (p0 - t0 > eps or t1 - p1 > eps):
+          trimmed = f"in{i}{stype}t{order[id(ffobj)]}"
+          pts = "setpts" if stype == "v" else "asetpts"
+          ffmpeg_filters.append(f"[{label}]{ftrim}=start={round(p0 - t0, 6)}:duration={round(p1 - p0, 6)},{pts}=PTS-STARTPTS[{trimmed}]")
+          label = trimmed
+        if stype == "v":
+          ffobj.vinput = label
+        else:
+          ffobj.ainput = label
+  return ffmpeg_files, ffmpeg_filters
+
+def merge_part(ffcmds_list, ffovls_list, framerate, asample_rate, ofile, threads=0):
+  ffmpeg_cmds = [ffmpeg_name]
+  ffmpeg_filters = []
   ffcmds_vanames = []
   ffsnds_anames = []
   ffovls_vnames = []
   total_deltat = 0.0
-  indexFile = 0
 #  print(f"ffcmds part {ofile}")
   for i, ffcmd in enumerate(ffcmds_list):
     ffcmd.index = i
-    ffcmd.update_index(indexFile)
     if ffcmd.create_out:
       total_deltat += ffcmd.part_deltat()
-    ffcmd_file = ffcmd.ffmpeg_file()
-    if ffcmd_file:
-      indexFile += 1
-      ffmpeg_files += ffcmd_file
 #    print(ffcmd)
 #  print("ffovls")
   overlay_deltat = 0.0
   for i, ffovl in enumerate(ffovls_list):
     ffovl.index = i
-    ffovl.update_index(indexFile)
-    if not ffovl.blank:
-      ffmpeg_files += ffovl.ffmpeg_file()
-      indexFile += 1
     overlay_deltat += ffovl.deltat
 #    print(ffovl)
+  ffmpeg_files, ffmpeg_filters = share_inputs(ffcmds_list + ffovls_list)
   if len(ffovls_list) > 0 and  math.fabs(total_deltat - overlay_deltat) > 0.001:
     raise RuntimeError(f"Times of streams are different: total_deltat={total_deltat} overlay_deltat={overlay_deltat}")
   for i, ffcmd in enumerate(ffcmds_list):
@@ -1587,24 +2563,26 @@ def merge_part(ffcmds_list, ffovls_list, framerate, ofile):
     ffmpeg_filters.append(ffvovlfilter)
   ffmpeg_cmds += ffmpeg_files
   filters_str = ';'.join(ffmpeg_filters)
+  if threads > 0:
+    ffmpeg_cmds += ['-filter_complex_threads', f"{threads}"]
   ffmpeg_cmds += ['-filter_complex', filters_str]
-  ffmpeg_cmds += ['-map', f"[{voutname}]", '-map', f"[{aoutname}]", "-c:a", "aac", "-r", f"{framerate}", "-video_track_timescale", f"{videoTimebase}", ofile ]
-  if not args.soundOnly and not debug_no_ffmpeg_exec:
-    subprocess.run(ffmpeg_cmds, cwd=projectFolder)
+  ffmpeg_cmds += ['-map', f"[{voutname}]", '-map', f"[{aoutname}]"] + intermediate_video() + intermediate_audio(asample_rate) + ["-r", f"{framerate}", "-video_track_timescale", f"{videoTimebase}"]
+  if threads > 0:
+    ffmpeg_cmds += ['-threads', f"{threads}"]
+  ffmpeg_cmds += [ofile]
   ffcmd_str =  " ".join(ffmpeg_cmds)
 #  print(f"{ofile} complex filter")
 #  print(f"{filters_str}")
 #  print(f"{ofile} total_deltat={total_deltat} overlay_deltat={overlay_deltat}")
-  return total_deltat
+  return total_deltat, ffmpeg_cmds
 
 
 #1
 #00:00:0,000 --> 00:00:2,000
 #This is the first sentence
 #ffmpeg -i input.mp4 -i subtitle.en.srt -c copy -c:s mov_text -metadata:s:s:0 language=eng ouptut_english.mp4
-def create_subtitles_file(ffcmds_list):
+def create_subtitles_file(ffcmds_list, strfileName, tfrom=0.0, tto=math.inf):
   tcurr = 0.0
-  strfileName = os.path.join(outputFolder, args.projectName + srtExt)
   subtitles = []
   index = 0
   for ffcmd in ffcmds_list:
@@ -1616,13 +2594,15 @@ def create_subtitles_file(ffcmds_list):
       texts.append(fftxt.text)
     text = ' '.join(texts)
     if tcurr > 0.0:
-      t0 = time2srttime(tcurr)
+      t0 = tcurr
     else:
-      t0 = time2srttime(tcurr + 1.0)
+      t0 = tcurr + 1.0
     tcurr += ffcmd.part_deltat()
-    t1 = time2srttime(tcurr)
-    if len(text) > 0:
+    t1 = tcurr
+    if len(text) > 0 and t1 > tfrom and t0 < tto:
       index += 1
+      t0 = time2srttime(max(t0, tfrom) - tfrom)
+      t1 = time2srttime(min(t1, tto) - tfrom)
       subtitles.append('\n'.join([f"{index}", f"{t0} --> {t1}", text]))
   text = '\n\n'.join(subtitles)
   with open(strfileName, 'wt') as f:
@@ -1630,49 +2610,136 @@ def create_subtitles_file(ffcmds_list):
  
 
 def merge_all_videos(ofile):
-  cleanTemporaryFolder()
+  if not debug_no_ffmpeg_exec:
+    if not os.path.exists(temporaryFolder):
+      os.makedirs(temporaryFolder)
+    cleanTemporaryFolder()
+  open_progress()
   ffcmds_list, ffsnds_list, ffovls_list = generate_ffcmds_list()
-  framerate = frameRate
-  asample_rate = audioSampleRate
-  for ffcmd in ffcmds_list:
-    ffcmd.verify()
+  strfileName = os.path.join(outputFolder, args.projectName + srtExt)
+  tfrom, tto = 0.0, math.inf
+  trim = None
+  full_cmds_list = ffcmds_list
+  if args.rangeFrom or args.rangeTo:
+    if args.rangeFrom:
+      tfrom = read_in_seconds(args.rangeFrom)
+    if args.rangeTo:
+      tto = read_in_seconds(args.rangeTo)
+    if tto <= tfrom:
+      raise ValueError(f"incorrect range {args.rangeFrom} - {args.rangeTo}")
+    ffcmds_list, trim = select_range(ffcmds_list, ffovls_list, ffsnds_list, tfrom, tto)
+    tto = tfrom + trim[1]
+    strfileName = os.path.splitext(ofile)[0] + srtExt
+  sound_future = None
+  sound_popens = []
+  sound_cancel = threading.Event()
+  def sound_started(p):
+    # the main thread may have failed before ffmpeg started, see the except below
+    sound_popens.append(p)
+    if sound_cancel.is_set():
+      p.terminate()
+  if len(ffsnds_list) > 0:
+    osfile = os.path.join(temporaryFolder, "sound_temp" + intermediateExt)
+    sound_duration = sum([ffcmd.part_deltat() for ffcmd in ffcmds_list if ffcmd.create_out])
+    expect_progress(sound_duration)
+    if debug_no_ffmpeg_exec:
+      make_sound(ffsnds_list, osfile, sound_duration)
+    else:
+      sound_executor = ThreadPoolExecutor(max_workers=1)
+      sound_future = sound_executor.submit(make_sound, ffsnds_list, osfile, sound_duration, sound_started)
+      sound_executor.shutdown(wait=False)
+  try:
+    framerate = frameRate
+    asample_rate = audioSampleRate
+    for ffcmd in ffcmds_list:
+      ffcmd.verify()
 #    print(ffcmd)
-  create_subtitles_file(ffcmds_list)
-  for ffovl in ffovls_list:
-    ffovl.verify()
-  for ffcmd in ffcmds_list:
-    if ffcmd.tvideo and ffcmd.base:
-      asample_rate = ffcmd.asample_rate
-      framerate = ffcmd.framerate
-      break 
-  fragments = split_fragments(ffcmds_list[:], ffovls_list)
-  filenames = []
-  ffcmds_num = 0
-  total_deltat = 0.0
-  for i, frag in enumerate(fragments):
-    ffile = os.path.join(temporaryFolder, "temp_" + str(i) + videoExt)
-    filenames += [ffile]
-    part_dt = merge_part(frag[0], frag[1], framerate, ffile)
-    total_deltat += part_dt
-    ffcmds_num += len(frag[0])
-  listFile = os.path.join(temporaryFolder, "files.txt")
-  with open(listFile, "wt") as f:
-    for fnm in filenames:
-      f.write(f"file '{fnm}'\n")
-  ovfile = ofile
+    if not debug_no_ffmpeg_exec:
+      create_subtitles_file(full_cmds_list, strfileName, tfrom, tto)
+    for ffovl in ffovls_list:
+      ffovl.verify()
+    for ffcmd in ffcmds_list:
+      if ffcmd.tvideo and ffcmd.base:
+        asample_rate = ffcmd.asample_rate
+        framerate = ffcmd.framerate
+        break 
+    if args.cutMode == "direct":
+      make_snapshots(ffcmds_list)
+    fragments = split_fragments(ffcmds_list[:], ffovls_list)
+    jobs = max(1, min(args.jobs, len(fragments)))
+    threads = ffmpeg_threads(jobs)
+    use_cache = fragmentCacheSize > 0
+    if use_cache and not debug_no_ffmpeg_exec and not os.path.exists(fragmentCacheFolder):
+      os.makedirs(fragmentCacheFolder)
+    filenames = []
+    parts_stages = []
+    parts_names = []
+    cached_files = []
+    reused = 0
+    ffcmds_num = 0
+    total_deltat = 0.0
+    for i, frag in enumerate(fragments):
+      ffile = os.path.join(temporaryFolder, "temp_" + str(i) + intermediateExt)
+      part_dt, ffmpeg_cmds = merge_part(frag[0], frag[1], framerate, asample_rate, ffile, threads)
+      total_deltat += part_dt
+      ffcmds_num += len(frag[0])
+      stage_name = f"fragment_{i}"
+      if use_cache:
+        ffile = os.path.join(fragmentCacheFolder, fragment_key(ffmpeg_cmds) + intermediateExt)
+        if os.path.exists(ffile) and not args.noCache:
+          if not debug_no_ffmpeg_exec:
+            os.utime(ffile)
+          plan_stage(stage_name, [], part_dt, outputs=[ffile], cached=True)
+          reused += 1
+        elif not ffile in [cfile for _, cfile in cached_files]:
+          tmpfile = os.path.join(temporaryFolder, "temp_" + str(i) + intermediateExt)
+          ffmpeg_cmds[-1] = tmpfile
+          parts_stages += [plan_stage(stage_name, ffmpeg_cmds, part_dt)]
+          cached_files += [(tmpfile, ffile)]
+      else:
+        parts_stages += [plan_stage(stage_name, ffmpeg_cmds, part_dt)]
+      parts_names += [stage_name]
+      filenames += [ffile]
+    expect_progress(trim[1] if trim else total_deltat)
+    if not args.soundOnly and not debug_no_ffmpeg_exec:
+      print(f"render {len(parts_stages)} fragments, reused {reused} from cache, jobs = {jobs}, threads per job = {threads if threads > 0 else 'auto'}")
+      expect_progress(sum([st["duration"] for st in parts_stages]))
+      run_ffmpeg_parallel(parts_stages, jobs)
+      for tmpfile, ffile in cached_files:
+        shutil.move(tmpfile, ffile)
+      if use_cache:
+        evict_fragment_cache(set(filenames))
+    listFile = os.path.join(temporaryFolder, "files.txt")
+    if not debug_no_ffmpeg_exec:
+      with open(listFile, "wt") as f:
+        for fnm in filenames:
+          f.write(f"file '{fnm}'\n")
+  except BaseException:
+    sound_cancel.set()
+    if sound_future:
+      sound_future.cancel()
+    for p in sound_popens:
+      p.terminate()
+    raise
+  final_deps = parts_names[:]
   if len(ffsnds_list) > 0:
-    ovfile = os.path.join(temporaryFolder, "video_temp" + videoExt)
-  ffmpeg_cmds = [ffmpeg_name, "-f", "concat", "-safe", "0", "-i", listFile, "-c:v", "copy", "-c:a", "aac", "-movflags", "faststart", ovfile]
-  if not args.soundOnly and not debug_no_ffmpeg_exec:
-    subprocess.run(ffmpeg_cmds, cwd=projectFolder)
+    if sound_future:
+      sound_future.result()
+    final_deps += ["sound"]
+  else:
+    osfile = None
+  ffmpeg_cmds, outputs = final_mux_cmds(listFile, osfile, framerate, ofile, trim)
+  if trim:
+    total_deltat = trim[1]
+  stage = plan_stage("final", ffmpeg_cmds, total_deltat, final_deps, outputs)
+  stage["inputs"] = filenames + ([osfile] if osfile else [])
+  if not debug_no_ffmpeg_exec:
+    for output in outputs:
+      os.makedirs(os.path.dirname(output), exist_ok=True)
+    p = run_ffmpeg(stage)
+    if p.returncode != 0:
+      raise RuntimeError(f"ffmpeg failed for {stage['name']}")
   print(" ".join(ffmpeg_cmds))
-  if len(ffsnds_list) > 0:
-    osfile = os.path.join(temporaryFolder, "sound_temp" + videoExt)
-    make_sound(ffsnds_list, osfile)
-    ffmpeg_cmds = [ffmpeg_name, "-i", ovfile, "-i", osfile, "-filter_complex", "[0:v]copy[vout];[0:a][1:a]amix=2:shortest[aout]", "-map", "[vout]", "-map", "[aout]", "-c:a", "aac", "-r", f"{framerate}", "-video_track_timescale", f"{videoTimebase}", "-movflags", "faststart", ofile]
-    if not debug_no_ffmpeg_exec:
-      subprocess.run(ffmpeg_cmds, cwd=projectFolder)
-    print(" ".join(ffmpeg_cmds))
   print("total fragments =", ffcmds_num, "framerate", framerate)
   print(f"Video length = {timedelta(seconds=total_deltat)}")
 
@@ -1687,9 +2754,10 @@ def merge_all_videos(ofile):
     sound_deltat += ffsnd.deltat
 #    print("sound volume=", ffsnd.svolume)
   print(f"total video time = {total_deltat}, sound time = {sound_deltat}")
+  close_progress()
 
 def youtube_encode(ifile, ofile):
-  ffmpeg_cmds = [ffmpeg_name, "-i", ifile, "-vf", "format=yuv420p", "-force_key_frames", "'expr:gte(t,n_forced/2)'", "-c:v", "libx264", "-crf", "18", "-bf", "2", "-c:a", "aac", "-q:a", "1", "-ac", "2", "-ar", "48000", "-use_editlist", "0", "-movflags", "+faststart", ofile]
+  ffmpeg_cmds = [ffmpeg_name, "-i", ifile] + delivery_video(None, True) + delivery_audio() + ["-use_editlist", "0", "-movflags", "+faststart", ofile]
   subprocess.run(ffmpeg_cmds, cwd=projectFolder)
   print(" ".join(ffmpeg_cmds))
 
@@ -1700,7 +2768,7 @@ def copySourceFiles(copyFolder):
   audio_names = {}
   ffcmds_list, ffsnds_list, ffovls_list = generate_ffcmds_list()
   for ffsnd in ffsnds_list:
-    if len(ffsnd.fname) == 0 or ffsnd.silent:
+    if len(ffsnd.fname) == 0:
       continue
     audio_names[os.path.basename(ffsnd.fname)] = ffsnd.fname
   for ffcmd in ffcmds_list:
@@ -1782,6 +2850,8 @@ if __name__ == "__main__":
     ts = datetime.now()
     if args.webm:
       webm2mp4(args.inputFile, args.outputFile)
+    if args.youtube:
+      youtube_encode(args.inputFile, args.outputFile)
     if args.makeProject:
       make_project()
     if args.cleanTemp:
@@ -1792,10 +2862,14 @@ if __name__ == "__main__":
       copySourceFiles(args.copyFolder)
     if args.cutVideos:
       cut_all_videos()
-    if args.mergeVideos:
+    if args.mergeVideos or debug_no_ffmpeg_exec:
       merge_all_videos( os.path.join(outputFolder, outputFileName) )
+    if debug_no_ffmpeg_exec:
+      write_plan(planFileName, (datetime.now()-ts).total_seconds())
     if args.timeLines:
       printTimelines()
+    print_stage_timings()
     print(f"Calculation time: {datetime.now()-ts}")
   except Exception as e:
     print("error: ", e)
+    sys.exit(1)